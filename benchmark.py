@@ -0,0 +1,313 @@
+"""
+Micro-benchmarks for the memory store.
+
+Usage:
+    python benchmark.py edits [--sizes 1000 10000 100000 1000000]
+    python benchmark.py ann [--sizes 10000 100000] [--k 10]
+    python benchmark.py stress [--seconds 10] [--readers 4] [--writers 2]
+    python benchmark.py startup [--model qwen2:7b] [--data-dir .]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import faiss
+from database import Database
+from embedding_cache import EmbeddingCache
+from vector_index import IdMappedIndex, build_index, memory_label, set_search_params
+
+
+def _random_vectors(n, dimension, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((n, dimension), dtype=np.float32)
+
+
+def _clustered_vectors(n, dimension, clusters=256, seed=0):
+    """Unit vectors drawn around random centres, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    vectors = centres[rng.integers(clusters, size=n)] + 0.5 * rng.standard_normal((n, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def benchmark_edits(sizes, dimension=768, edits=200):
+    """
+    Time single UPDATE and DELETE operations on the vector index for growing
+    corpus sizes. Embedding time is excluded, only the index edit is measured.
+    """
+    print(f"{'memories':>10} {'update (ms)':>12} {'delete (ms)':>12}")
+    for size in sizes:
+        index = IdMappedIndex(dimension)
+        index.add(np.arange(1, size + 1), _random_vectors(size, dimension))
+        replacement = _random_vectors(1, dimension, seed=1)
+        rng = np.random.default_rng(2)
+        targets = rng.choice(np.arange(1, size + 1), size=min(edits, size), replace=False)
+
+        start = time.perf_counter()
+        for label in targets:
+            index.replace(int(label), replacement)
+        update_ms = (time.perf_counter() - start) * 1000 / len(targets)
+
+        start = time.perf_counter()
+        for label in targets:
+            index.remove([int(label)])
+        delete_ms = (time.perf_counter() - start) * 1000 / len(targets)
+
+        print(f"{size:>10} {update_ms:>12.4f} {delete_ms:>12.4f}")
+
+
+ANN_CONFIGS = [
+    ("flat", {}, [{}]),
+    ("ivf_flat", {}, [{"nprobe": n} for n in (1, 4, 16, 64)]),
+    ("hnsw", {"hnsw_m": 32}, [{"ef_search": ef} for ef in (16, 32, 64, 128)]),
+    ("ivf_pq", {}, [{"nprobe": n} for n in (4, 16, 64)]),
+]
+
+
+def benchmark_ann(sizes, dimension=768, queries=200, k=10):
+    """
+    Recall@k and per-query latency of each index type against exact search,
+    to pick index_type / search_params for a given corpus size.
+    """
+    for size in sizes:
+        data = _clustered_vectors(size + queries, dimension)
+        corpus, query_vectors = data[:size], data[size:]
+        exact = faiss.IndexFlatL2(dimension)
+        exact.add(corpus)
+        _, truth = exact.search(query_vectors, k)
+
+        print(f"\n{size} memories, d={dimension}, recall@{k}")
+        print(f"{'index':>10} {'params':>16} {'build (s)':>10} {'recall':>8} {'ms/query':>10}")
+        for index_type, build_params, search_variants in ANN_CONFIGS:
+            start = time.perf_counter()
+            index = IdMappedIndex(dimension, index=build_index(index_type, dimension, corpus, **build_params))
+            index.add(np.arange(size), corpus)
+            build_s = time.perf_counter() - start
+
+            for search_params in search_variants:
+                set_search_params(index.index, **search_params)
+                start = time.perf_counter()
+                _, labels = index.search(query_vectors, k)
+                query_ms = (time.perf_counter() - start) * 1000 / queries
+                recall = np.mean([len(np.intersect1d(found, expected)) / k for found, expected in zip(labels, truth)])
+                params = ",".join(f"{key}={value}" for key, value in search_params.items()) or "-"
+                print(f"{index_type:>10} {params:>16} {build_s:>10.2f} {recall:>8.3f} {query_ms:>10.3f}")
+
+
+class _HashEmbeddingDatabase(Database):
+    """Database whose embeddings are derived from a hash of the text, so it runs without Ollama."""
+
+    dimension = 64
+
+    def _embed_batch(self, batch, model, ollama_url):
+        vectors = []
+        for text in batch:
+            seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+            vectors.append(np.random.default_rng(seed).standard_normal(self.dimension, dtype=np.float32))
+        return batch, np.array(vectors, dtype=np.float32)
+
+
+def benchmark_stress(seconds=10.0, readers=4, writers=2, initial=2000, index_type="flat"):
+    """
+    Run searches and ADD/UPDATE/DELETE from several threads at once, then
+    check that search results, metadata, index and the reloaded files all
+    agree. Prints throughput and search latency percentiles.
+    """
+    directory = tempfile.mkdtemp(prefix="memory_stress_")
+    database_kwargs = {"embedding_cache": EmbeddingCache(None), "checkpoint_every": 500,
+                       "index_type": index_type, "promote_at": int(initial * 1.1)}
+    db = _HashEmbeddingDatabase.in_directory(directory, **database_kwargs)
+    db.add_memories([f"seed memory {i}" for i in range(initial)])
+    db.create_vector_database(dimension=_HashEmbeddingDatabase.dimension)
+
+    deadline = time.perf_counter() + seconds
+    errors = []
+    latencies = [[] for _ in range(readers)]
+    write_counts = [0] * writers
+
+    def read(slot):
+        rng = random.Random(slot)
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                results = db.similarity_search(f"seed memory {rng.randrange(initial * 2)}", k=10)
+                latencies[slot].append(time.perf_counter() - start)
+                for result in results:
+                    if result['content'] is None:
+                        raise AssertionError(f"{result['memory_id']} hydrated without content")
+        except Exception as e:
+            errors.append(e)
+
+    def write(slot):
+        rng = random.Random(1000 + slot)
+        try:
+            while time.perf_counter() < deadline:
+                memory_ids = [record.memory_id for record in db.memories[-200:]]
+                operation = rng.random()
+                if operation < 0.4 or not memory_ids:
+                    db.add_memory(f"writer {slot} memory {write_counts[slot]}")
+                elif operation < 0.8:
+                    db.update_memory(rng.choice(memory_ids), f"writer {slot} update {write_counts[slot]}")
+                else:
+                    db.delete_memory(rng.choice(memory_ids))
+                write_counts[slot] += 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(slot,)) for slot in range(readers)]
+    threads += [threading.Thread(target=write, args=(slot,)) for slot in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if db._promotion_thread is not None:
+        db._promotion_thread.join()
+
+    def check(database, label):
+        with database._lock.read():
+            indexed = set(database.vector_index.row_keys())
+            stored = {record.memory_id for record in database.memories}
+            if indexed != stored:
+                errors.append(AssertionError(f"{label}: index and metadata disagree on {len(indexed ^ stored)} memories"))
+            # PQ codes only approximate the vectors they were built from
+            lossless = database.vector_index.index_type != "ivf_pq"
+            for record in list(database.memories)[:500] if lossless else []:
+                expected = database.embed_text(record.content)
+                if not np.allclose(database.vector_index.reconstruct(memory_label(record.memory_id)), expected, atol=1e-5):
+                    errors.append(AssertionError(f"{label}: stale vector for {record.memory_id}"))
+                    break
+        return len(stored)
+
+    live = check(db, "in memory")
+    db.close()
+    reloaded = _HashEmbeddingDatabase.in_directory(directory, **database_kwargs)
+    reloaded.create_vector_database(dimension=_HashEmbeddingDatabase.dimension)
+    if check(reloaded, "reloaded") != live:
+        errors.append(AssertionError("reloaded shard has a different number of memories"))
+    reloaded.close()
+
+    all_latencies = np.array([latency for slot in latencies for latency in slot]) * 1000
+    print(f"{readers} readers, {writers} writers, {seconds:.0f}s, {index_type} index, {live} memories at the end")
+    print(f"searches: {len(all_latencies)} ({len(all_latencies) / seconds:.0f}/s), "
+          f"p50 {np.percentile(all_latencies, 50):.2f} ms, p99 {np.percentile(all_latencies, 99):.2f} ms")
+    print(f"writes:   {sum(write_counts)} ({sum(write_counts) / seconds:.0f}/s)")
+    if errors:
+        for error in errors:
+            print(f"❌ {error!r}")
+        raise SystemExit(1)
+    print("✅ index, metadata and reloaded files are consistent")
+
+
+# Runs in a fresh interpreter so import costs are measured cold
+_STARTUP_CHILD = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+fast_start = sys.argv[2] == "fast_start"
+stages = []
+
+def timed(name, fn):
+    start = time.perf_counter()
+    try:
+        result, error = fn(), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    stages.append([name, time.perf_counter() - start, error])
+    return result
+
+chat = timed("import chat", lambda: __import__("chat"))
+bot = timed("construct chatbot", lambda: chat.MemoryAwareChatbot(model_name=sys.argv[3], fast_start=fast_start))
+stages.append(["ready for first prompt", sum(stage[1] for stage in stages), None])
+if bot is not None:
+    timed("first reply", lambda: bot.llm.generate("Say hi in one word."))
+    timed("index ready", bot.db.wait_for_index)
+    timed("first search", lambda: bot.db.similarity_search("hobbies", k=5))
+print("STAGES " + json.dumps(stages))
+"""
+
+_DATA_FILES = ("summary.txt", "message.json", "memories.json", "memory_index.faiss", "memory_embeddings.json",
+               "memory_journal.jsonl", "memory_checkpoint.json", "embedding_cache.sqlite", "vector_store")
+
+
+def benchmark_startup(model_name="qwen2:7b", data_dir="."):
+    """
+    Cold start of the chatbot, eager vs fast_start, broken down per stage.
+    Each mode runs in a fresh interpreter on a temporary copy of the data
+    files in `data_dir`, so nothing there is modified.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for mode in ("eager", "fast_start"):
+        with tempfile.TemporaryDirectory(prefix="memory_startup_") as directory:
+            for name in _DATA_FILES:
+                source = os.path.join(data_dir, name)
+                if os.path.isdir(source):
+                    shutil.copytree(source, os.path.join(directory, name))
+                elif os.path.exists(source):
+                    shutil.copy(source, directory)
+            child = subprocess.run([sys.executable, "-c", _STARTUP_CHILD, root, mode, model_name],
+                                   cwd=directory, capture_output=True, text=True)
+        line = next((line for line in child.stdout.splitlines() if line.startswith("STAGES ")), None)
+        if line is None:
+            print(f"❌ {mode} run failed:\n{child.stderr[-2000:]}")
+            return
+        results[mode] = json.loads(line[len("STAGES "):])
+
+    print(f"{'stage':<24} {'eager (s)':>10} {'fast_start (s)':>15}")
+    errors = []
+    for (name, eager_s, eager_error), (_, fast_s, fast_error) in zip(results["eager"], results["fast_start"]):
+        cells = []
+        for mode, seconds, error in (("eager", eager_s, eager_error), ("fast_start", fast_s, fast_error)):
+            cells.append("error" if error else f"{seconds:.3f}")
+            if error:
+                errors.append(f"{mode} / {name}: {error}")
+        print(f"{name:<24} {cells[0]:>10} {cells[1]:>15}")
+    for error in errors:
+        print(f"⚠️ {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    edits = subparsers.add_parser("edits", help="UPDATE/DELETE latency vs corpus size")
+    edits.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    edits.add_argument("--dimension", type=int, default=768)
+
+    ann = subparsers.add_parser("ann", help="recall@k vs latency per index type")
+    ann.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    ann.add_argument("--dimension", type=int, default=768)
+    ann.add_argument("--k", type=int, default=10)
+
+    stress = subparsers.add_parser("stress", help="concurrent searches and writes on one Database")
+    stress.add_argument("--seconds", type=float, default=10.0)
+    stress.add_argument("--readers", type=int, default=4)
+    stress.add_argument("--writers", type=int, default=2)
+    stress.add_argument("--initial", type=int, default=2000)
+    stress.add_argument("--index-type", default="flat")
+
+    startup = subparsers.add_parser("startup", help="cold start time per stage, eager vs fast_start")
+    startup.add_argument("--model", default="qwen2:7b")
+    startup.add_argument("--data-dir", default=".")
+
+    args = parser.parse_args()
+    if args.command == "edits":
+        benchmark_edits(args.sizes, args.dimension)
+    elif args.command == "ann":
+        benchmark_ann(args.sizes, args.dimension, k=args.k)
+    elif args.command == "stress":
+        benchmark_stress(args.seconds, args.readers, args.writers, args.initial, args.index_type)
+    elif args.command == "startup":
+        benchmark_startup(args.model, args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
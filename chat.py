@@ -1,38 +1,82 @@
 import json
 import os
+import threading
 from datetime import datetime
 from database import Database
+from shards import ShardManager, alease_database, lease_database, resolve_database
 from extraction import Extraction
+from ingestion import IngestionQueue, IngestionWorker
 from ollama_wrapper import OllamaLLM
 from update import UpdatePhase
 from prompts import create_chat_prompt
 class MemoryAwareChatbot:
     """A chatbot that uses mem0 for memory management and Ollama for generation"""
     
-    def __init__(self, model_name="qwen2:7b"):
-        self.llm = OllamaLLM(model_name)
+    def __init__(self, model_name="qwen2:7b", user_id=None, shard_manager=None, fast_start=False,
+                 background_ingestion=True, ingestion_queue="./ingestion_queue.sqlite", response_cache=None,
+                 phase_options=None):
+        """
+        Args:
+            model_name: Ollama model used for chat, extraction and updates.
+            user_id: Routes memories to this user's shard. Without it the
+                files in the current directory are used, as before.
+            shard_manager: ShardManager to route through; one rooted at ./shards is created if omitted.
+            fast_start: Accept the first prompt before the vector index is
+                loaded and the models are warm. The index loads on a background
+                thread (memory search and updates wait for it) and a warm-up
+                request preloads the chat and embedding models.
+            background_ingestion: Extract and store memories on a background
+                worker, so chat() returns right after the reply is generated.
+            ingestion_queue: sqlite file persisting the turns awaiting ingestion.
+            response_cache: Optional ResponseCache for extraction, update and
+                summary prompts, e.g. when re-ingesting conversation logs.
+            phase_options: Per-phase Ollama options merged over GENERATION_PRESETS.
+        """
+        self.llm = OllamaLLM(model_name, response_cache=response_cache, phase_options=phase_options)
         
 
-        if not self.llm.check_connection():
+        self._warm_up_thread = None
+        if fast_start:
+            self._warm_up_thread = threading.Thread(target=self.llm.warm_up, name="model-warm-up", daemon=True)
+            self._warm_up_thread.start()
+        elif not self.llm.check_connection():
             print("⚠️  Warning: Cannot connect to Ollama. Make sure it's running with 'ollama serve'")
         
-        self.db = Database()
+        self.user_id = user_id
+        if user_id is None:
+            self._db = Database()
+        else:
+            self._db = shard_manager if shard_manager is not None else ShardManager(background_load=fast_start)
+        self.llm.embedding_cache = self._db.embedding_cache
         
-        self.extractor = Extraction(self.llm, self.db)
+        self.extractor = Extraction(self.llm, self._db, user_id=user_id)
         self.conversation_history = []
-        self.update_phase = UpdatePhase(self.llm, self.db)
+        self.update_phase = UpdatePhase(self.llm, self._db, user_id=user_id)
+        self.ingestion = None
+        if background_ingestion:
+            self.ingestion = IngestionWorker(
+                self.extractor, self.update_phase, IngestionQueue(ingestion_queue, user_id=user_id)
+            )
 
         
         
         # Initialize vector database if not exists
         if self.db.vector_index is None:
-            print("Initializing vector database...")
-            self.db.create_vector_database()
+            if fast_start:
+                self.db.start_background_load()
+            else:
+                print("Initializing vector database...")
+                self.db.create_vector_database()
         
         print("✅ Chatbot initialized successfully!")
         print(f"📚 Loaded memories")
         print(f"🤖 Using model: {model_name}")
     
+    @property
+    def db(self):
+        """This user's Database; shards are looked up per call so evicted ones are reopened."""
+        return resolve_database(self._db, self.user_id)
+
     def _save_message_to_history(self, user_message, bot_response):
         """Save the conversation turn to message history"""
         timestamp = datetime.now().isoformat()
@@ -44,20 +88,21 @@ class MemoryAwareChatbot:
         
         self.conversation_history.append(message_pair)
         
-        # Handle both list format (legacy) and dict format (new)
-        if isinstance(self.db.recent_messages, list):
-            # Convert to new format
-            self.db.recent_messages = {"messages": self.db.recent_messages}
-        
-        # Update the database's recent messages
-        if "messages" not in self.db.recent_messages:
-            self.db.recent_messages["messages"] = []
-        
-        self.db.recent_messages["messages"].append(message_pair)
-        
-        # Save to file
-        with open(self.db.messages_file, 'w') as f:
-            json.dump(self.db.recent_messages, f, indent=2)
+        with lease_database(self._db, self.user_id) as db:
+            # Handle both list format (legacy) and dict format (new)
+            if isinstance(db.recent_messages, list):
+                # Convert to new format
+                db.recent_messages = {"messages": db.recent_messages}
+            
+            # Update the database's recent messages
+            if "messages" not in db.recent_messages:
+                db.recent_messages["messages"] = []
+            
+            db.recent_messages["messages"].append(message_pair)
+            
+            # Save to file
+            with open(db.messages_file, 'w') as f:
+                json.dump(db.recent_messages, f, indent=2)
 
     def _get_summary(self, user_message):
         """Retrieve summary in the database"""
@@ -88,30 +133,22 @@ class MemoryAwareChatbot:
         print(f"👤 User: {user_message}")
         self.extractor.messages_count += 1
         
-        # Get relevant context from memories
-        memory_context = self._get_summary(user_message)
-
-        # Get recent conversation context
-        recent_context = self._get_recent_conversation()
-        
-        # Build the complete prompt
-        full_prompt = create_chat_prompt( user_message, memory_context, recent_context)
+        full_prompt = self._build_prompt(user_message)
         
         # print(f"🤖 Generating response with context:\n{full_prompt}")
         # Generate response
         try:
-            response = self.llm.generate(full_prompt, temperature=0.7)
+            response = self.llm.generate(full_prompt)
             print(f"🤖 Assistant: {response}")
             
             # Save the conversation
             self._save_message_to_history(user_message, response)
             
-            # Extract and store memories
-            memories = self.extractor.extract_memories(user_message, response)
-            if memories == []:
-                print("No new memories extracted.")
-                return response
-            self.update_phase.process_extracted_memories(memories)
+            # Extract and store memories; the reply is returned even if that fails
+            try:
+                self._store_memories(user_message, response)
+            except Exception as e:
+                print(f"❌ Could not store memories for this turn: {e}")
             return response
             
         except Exception as e:
@@ -119,9 +156,99 @@ class MemoryAwareChatbot:
             print(f"🤖 Assistant: {error_msg}")
             return error_msg
     
+    def chat_stream(self, user_message):
+        """
+        Streaming chat: yields the reply in pieces as they are generated.
+        History and memories are saved once the reply is complete.
+        """
+        self.extractor.messages_count += 1
+        full_prompt = self._build_prompt(user_message)
+        
+        pieces = []
+        for piece in self.llm.stream(full_prompt):
+            pieces.append(piece)
+            yield piece
+        response = "".join(pieces)
+        
+        try:
+            self._save_message_to_history(user_message, response)
+            self._store_memories(user_message, response)
+        except Exception as e:
+            print(f"❌ Could not store memories for this turn: {e}")
+    
+    def _build_prompt(self, user_message):
+        # Get relevant context from memories
+        memory_context = self._get_summary(user_message)
+
+        # Get recent conversation context
+        recent_context = self._get_recent_conversation()
+        
+        # Build the complete prompt
+        prompt = create_chat_prompt( user_message, memory_context, recent_context)
+        if prompt.truncated:
+            trimmed = ", ".join(f"{name} {before}→{prompt.sections[name]}" for name, before in prompt.truncated.items())
+            print(f"✂️  Prompt trimmed to {prompt.tokens} tokens ({trimmed})")
+        return prompt
+    
+    def _store_memories(self, user_message, response):
+        if self.ingestion is not None:
+            # Memories are extracted and stored off the response path
+            self.ingestion.submit(user_message, response)
+            return
+        memories = self.extractor.extract_memories(user_message, response)
+        if memories == []:
+            print("No new memories extracted.")
+            return
+        self.update_phase.process_extracted_memories(memories)
+    
+    async def achat(self, user_message):
+        """Async chat: LLM, embedding and memory writes are awaited, so many sessions can share one event loop"""
+        print(f"👤 User: {user_message}")
+        self.extractor.messages_count += 1
+        
+        # Pin the shard for the turn; a cold one is loaded off the event loop,
+        # so the prompt and history below never block other sessions on disk
+        async with alease_database(self._db, self.user_id):
+            full_prompt = self._build_prompt(user_message)
+        
+            try:
+                response = await self.llm.agenerate(full_prompt)
+                print(f"🤖 Assistant: {response}")
+            
+                self._save_message_to_history(user_message, response)
+            
+                try:
+                    memories = await self.extractor.aextract_memories(user_message, response)
+                    if memories == []:
+                        print("No new memories extracted.")
+                        return response
+                    await self.update_phase.aprocess_extracted_memories(memories)
+                except Exception as e:
+                    print(f"❌ Could not store memories for this turn: {e}")
+                return response
+            
+            except Exception as e:
+                error_msg = f"I apologize, but I encountered an error: {e}"
+                print(f"🤖 Assistant: {error_msg}")
+                return error_msg
+    
+    def flush_memories(self, timeout=None):
+        """Wait until memories from every turn so far are stored; False on timeout."""
+        if self.ingestion is None:
+            return True
+        return self.ingestion.flush(timeout)
+
+    def close(self):
+        """Finish pending memory ingestion and stop the worker."""
+        if self.ingestion is not None:
+            self.ingestion.close()
+            self.ingestion = None
+
     def show_memories(self, limit=10):
         """Display stored memories"""
         print(f"\n📚 Recent Memories (showing last {limit}):")
+        if self.ingestion is not None and self.ingestion.pending:
+            print(f"({self.ingestion.pending} recent turns are still being processed)")
         print("-" * 50)
         recent_memories = self.db.memories[-limit:]
         for memory in recent_memories:
@@ -130,11 +257,11 @@ class MemoryAwareChatbot:
             print(f"Date: {memory['updated_date']}")
             print("-" * 30)
     
-    def search_memories(self, query, k=5):
-        """Search memories by similarity"""
+    def search_memories(self, query, k=5, mode="hybrid"):
+        """Search memories by similarity and keywords; mode="lexical" matches keywords only, without embedding"""
         print(f"\n🔍 Searching memories for: '{query}'")
         print("-" * 50)
-        results = self.db.similarity_search(query, k=k)
+        results = self.db.similarity_search(query, k=k, mode=mode)
         for i, result in enumerate(results, 1):
             print(f"{i}. Score: {result['score']:.3f}")
             print(f"   Content: {result['content']}")
@@ -148,9 +275,10 @@ def main():
     
     try:
         # Initialize chatbot
-        chatbot = MemoryAwareChatbot(model_name="qwen2:7b")
+        # The index loads and the model warms up while the user types
+        chatbot = MemoryAwareChatbot(model_name="qwen2:7b", fast_start=True)
         
-        print("\n💬 Chat started! Type 'quit' to exit, 'memories' to view stored memories, or 'search: <query>' to search memories.")
+        print("\n💬 Chat started! Type 'quit' to exit, 'memories' to view stored memories, or 'search: <query>' / 'find: <words>' to search memories.")
         print("=" * 50)
         
         while True:
@@ -173,12 +301,21 @@ def main():
                         print("Please provide a search query: search: <your query>")
                     continue
                 
+                elif user_input.lower().startswith('find:'):
+                    query = user_input[5:].strip()
+                    if query:
+                        chatbot.search_memories(query, mode="lexical")
+                    else:
+                        print("Please provide keywords: find: <words>")
+                    continue
+                
                 elif user_input.lower() == 'help':
                     print("""
 Available commands:
 - quit/exit/bye: End the conversation
 - memories: Show recent stored memories
 - search: <query>: Search memories for specific content
+- find: <words>: Find memories containing these exact words (instant, no embedding)
 - help: Show this help message
 - Just type normally to chat!
                     """)
@@ -187,8 +324,15 @@ Available commands:
                 elif not user_input:
                     continue
                 
-                # Regular chat
-                chatbot.chat(user_input)
+                # Regular chat, rendered as the tokens arrive
+                print("🤖 Assistant: ", end="", flush=True)
+                for piece in chatbot.chat_stream(user_input):
+                    print(piece, end="", flush=True)
+                print()
+                metrics = chatbot.llm.last_metrics
+                if metrics is not None and metrics.time_to_first_token is not None:
+                    speed = f", {metrics.tokens_per_second:.1f} tokens/s" if metrics.tokens_per_second else ""
+                    print(f"⏱️  first token {metrics.time_to_first_token:.2f}s{speed}")
                 
             except KeyboardInterrupt:
                 print("\n\n👋 Goodbye! It was nice chatting with you.")
@@ -196,6 +340,9 @@ Available commands:
             except Exception as e:
                 print(f"❌ An error occurred: {e}")
                 print("Let's continue chatting...")
+        
+        # Store memories from turns still in the ingestion queue
+        chatbot.close()
     
     except Exception as e:
         print(f"❌ Failed to initialize chatbot: {e}")
@@ -1,22 +1,139 @@
 import json
-import faiss
 import numpy as np
-import requests
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from embedding_cache import EmbeddingCache
+from journal import MemoryJournal, atomic_write, decode_vector
+from lexical_index import LexicalIndex
+from memory_store import MemoryStore
+from rwlock import KeyedLock, ReadWriteLock
+from vector_store import VectorStore, content_hash
+# faiss (through vector_index), requests, asyncio and httpx are imported where
+# they are first needed, so constructing a Database does not pay for them
+
+class RetrievalPolicy:
+    """
+    Decides how many similarity_search hits are worth keeping.
+
+    Hits are cut at `max_k`, at `max_distance` (squared L2 on normalized
+    embeddings, so 1.0 means cosine similarity 0.5), and once a hit's score
+    falls more than `relative_gap` below the best hit's score. A query with
+    no close neighbours therefore returns nothing instead of k unrelated
+    memories.
+    """
+
+    def __init__(self, max_k: int = 5, max_distance: float = None, relative_gap: float = None):
+        self.max_k = max_k
+        self.max_distance = max_distance
+        self.relative_gap = relative_gap
+
+    def apply(self, results):
+        """Split score-ordered results into (kept, pruned)."""
+        kept = []
+        for result in results[:self.max_k]:
+            # Lexical-only hits have no vector distance
+            if self.max_distance is not None and result['distance'] is not None and result['distance'] > self.max_distance:
+                break
+            if self.relative_gap is not None and kept and result['score'] < kept[0]['score'] * (1 - self.relative_gap):
+                break
+            kept.append(result)
+        return kept, results[len(kept):]
+
+
+SEARCH_MODES = ("vector", "hybrid", "lexical")
+
 
 class Database:
-    def __init__(self,summary_file='./summary.txt', messages_file="./message.json",memories="./memories.json"):
+    def __init__(self,summary_file='./summary.txt', messages_file="./message.json",memories="./memories.json",
+                 embedding_cache: EmbeddingCache = None, embed_batch_size: int = 64, embed_workers: int = 4,
+                 vector_store_dir: str = "./vector_store",
+                 vector_index_file: str = "./memory_index.faiss",
+                 journal_file: str = "./memory_journal.jsonl", checkpoint_file: str = "./memory_checkpoint.json",
+                 checkpoint_every: int = 100, checkpoint_ratio: float = 0.1, index_type: str = "flat",
+                 promote_at: int = 50000,
+                 index_params: dict = None, search_params: dict = None, hybrid_alpha: float = 0.5):
         self.summary_file = summary_file
         self.messages_file = messages_file
         self.memories_file = memories
+        self.vector_store = VectorStore(vector_store_dir)
+        self.vector_index_file = vector_index_file
+        self.checkpoint_file = checkpoint_file
+        # A checkpoint rewrites the whole corpus, so it is due once the journal
+        # holds checkpoint_ratio of it, and at least checkpoint_every operations
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_ratio = checkpoint_ratio
+        self._checkpoint_thread = None
+        # Held from a checkpoint's snapshot until its manifest is written; taken after _write_lock
+        self._checkpoint_lock = threading.Lock()
+        self.journal = MemoryJournal(journal_file)
+        # Sequence numbers the files on disk reflect; journal entries above them get replayed
+        # index_version names the vector_store version the index was saved as, 0 for the unversioned layout
+        self._checkpoint = {"version": 0, "seq": 0, "index_seq": 0, "index_version": 0, "next_memory_number": 1,
+                            "normalized": False}
+        self._journal_tail = []
         self.conversation_summary = ""
-        self.memories = []
+        self.memories = MemoryStore()
+        # BM25 over memory contents, edited together with self.memories
+        self.lexical_index = LexicalIndex()
+        # Weight of vector similarity against normalized BM25 in hybrid search
+        self.hybrid_alpha = hybrid_alpha
         self.recent_messages = {}
         self.vector_index = None
-        self.memory_embeddings = {}
+        self._owns_embedding_cache = embedding_cache is None
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache()
+        # ANN index used once the corpus reaches promote_at memories, flat below that
+        self.index_type = index_type
+        self.promote_at = promote_at
+        self.index_params = index_params or {}
+        self.search_params = search_params or {}
+        # Searches share _lock. Writers serialize on _write_lock and take _lock
+        # exclusively only for O(d) in-memory edits and index version swaps.
+        self._lock = ReadWriteLock()
+        self._write_lock = threading.RLock()
+        # Held by callers across a read-decide-write of one memory, e.g. UpdatePhase
+        self.memory_locks = KeyedLock()
+        # Bumped by every committed write, together with the edit becoming visible to searches
+        self.write_version = 0
+        self._promotion_thread = None
+        self._promotion_touched = None
+        self._index_loader = None
+        # added/changed/removed memory_ids of the last load-time reconcile
+        self.last_reconcile = None
+        self.embed_batch_size = embed_batch_size
+        self.embed_workers = embed_workers
         self.load_files()
 
+    @classmethod
+    def in_directory(cls, directory: str, **kwargs):
+        """
+        A Database whose files all live under `directory`, created empty if
+        missing. Used for per-user shards; `kwargs` go to the constructor.
+        """
+        os.makedirs(directory, exist_ok=True)
+        return cls(
+            summary_file=os.path.join(directory, "summary.txt"),
+            messages_file=os.path.join(directory, "message.json"),
+            memories=os.path.join(directory, "memories.json"),
+            vector_store_dir=os.path.join(directory, "vector_store"),
+            vector_index_file=os.path.join(directory, "memory_index.faiss"),
+            journal_file=os.path.join(directory, "memory_journal.jsonl"),
+            checkpoint_file=os.path.join(directory, "memory_checkpoint.json"),
+            **kwargs
+        )
+
+    def _create_missing_files(self):
+        defaults = {
+            self.summary_file: "",
+            self.messages_file: json.dumps({"messages": []}, indent=2),
+            self.memories_file: json.dumps([], indent=2)
+        }
+        for path, data in defaults.items():
+            if not os.path.exists(path):
+                atomic_write(path, data)
+
     def load_files(self):
+        self._create_missing_files()
         with open(self.summary_file, 'r') as f:
             self.conversation_summary = f.read().strip()
 
@@ -24,9 +141,20 @@ class Database:
         with open(self.messages_file, 'r') as f:
             messages_data = json.load(f)
             self.recent_messages = messages_data
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r') as f:
+                self._checkpoint.update(json.load(f))
         with open(self.memories_file, 'r') as f:
             memories_data = json.load(f)
-            self.memories = memories_data
+            self.memories = MemoryStore(memories_data, next_number=self._checkpoint['next_memory_number'])
+        self.lexical_index = LexicalIndex((record.memory_id, record.content) for record in self.memories)
+        self.journal.last_seq = max(self.journal.last_seq, self._checkpoint['seq'])
+
+        # Replay operations logged since the last checkpoint. The vector part
+        # is applied once the index is loaded in create_vector_database.
+        self._journal_tail = list(self.journal.replay(after_seq=self._checkpoint['seq']))
+        for entry in self._journal_tail:
+            self._apply_to_memories(entry)
 
     def save_summary(self):
         """
@@ -48,190 +176,727 @@ class Database:
             return []
 
     def embed_text(self, text: str, model: str = "nomic-embed-text", ollama_url: str = "http://localhost:11434"):
-        response = requests.post(
-            f"{ollama_url}/api/embeddings",
-            json={
-                "model": model,
-                "prompt": text
-            }
-        )
-        response.raise_for_status()
-        embedding_data = response.json()
-        return np.array(embedding_data["embedding"], dtype=np.float32)
+        return self.embed_texts([text], model=model, ollama_url=ollama_url)[0]
+
+    def embed_texts(self, texts, model: str = "nomic-embed-text", ollama_url: str = "http://localhost:11434",
+                    show_progress: bool = False):
+        """
+        Embed many texts at once and return them as one float32 matrix.
 
-    def create_vector_database(self, dimension=768,memory_file: str = "memory_embeddings.json",vector_index_file: str = "memory_index.faiss"):
+        Cache misses are sent in batches of `embed_batch_size` to Ollama's
+        multi-input /api/embed endpoint, with up to `embed_workers` batches in
+        flight. Every finished batch goes into the embedding cache straight
+        away, so calling this again after an interrupted build only embeds
+        what is still missing. Vectors are L2-normalized so both endpoints
+        produce comparable distances.
+        """
+        embeddings = [self.embedding_cache.get(model, text) for text in texts]
+        pending = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+
+        if pending:
+            batches = [pending[i:i + self.embed_batch_size] for i in range(0, len(pending), self.embed_batch_size)]
+            fresh = {}
+
+            def store(batch, vectors):
+                self.embedding_cache.put_many(model, batch, vectors)
+                fresh.update(zip(batch, vectors))
+                if show_progress:
+                    print(f"Embedded {len(fresh)}/{len(pending)} texts ({len(texts) - len(pending)} cached)")
+
+            if len(batches) == 1:
+                # Single texts and small batches, the search and write hot path, need no worker threads
+                store(*self._embed_batch(batches[0], model, ollama_url))
+            else:
+                with ThreadPoolExecutor(max_workers=self.embed_workers) as pool:
+                    futures = [pool.submit(self._embed_batch, batch, model, ollama_url) for batch in batches]
+                    for future in as_completed(futures):
+                        store(*future.result())
+            embeddings = [fresh[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        return self._stack_normalized(embeddings)
+
+    async def aembed_texts(self, texts, model: str = "nomic-embed-text", ollama_url: str = "http://localhost:11434"):
+        """
+        Async embed_texts: cache misses go out in batches over the shared
+        async Ollama client, at most `embed_workers` batches at a time.
+        """
+        embeddings = [self.embedding_cache.get(model, text) for text in texts]
+        pending = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+
+        if pending:
+            import asyncio
+            from ollama_client import get_async_client
+            client = get_async_client(ollama_url)
+            slots = asyncio.Semaphore(self.embed_workers)
+
+            async def embed_batch(batch):
+                async with slots:
+                    vectors = await client.embed(batch, model)
+                self.embedding_cache.put_many(model, batch, vectors)
+                return batch, vectors
+
+            batches = [pending[i:i + self.embed_batch_size] for i in range(0, len(pending), self.embed_batch_size)]
+            fresh = {}
+            for batch, vectors in await asyncio.gather(*(embed_batch(batch) for batch in batches)):
+                fresh.update(zip(batch, vectors))
+            embeddings = [fresh[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        return self._stack_normalized(embeddings)
+
+    @staticmethod
+    def _stack_normalized(embeddings):
+        if not len(embeddings):
+            return np.empty((0, 0), dtype=np.float32)
+        matrix = np.vstack(embeddings).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def _embed_batch(self, batch, model, ollama_url):
+        from ollama_client import get_client
+        return batch, get_client(ollama_url).embed(batch, model)
+
+    def create_vector_database(self, dimension=768,memory_file: str = "memory_embeddings.json",vector_index_file: str = None):
+        """
+        Load the vector index, or build it from the memories if there is no
+        usable saved one. `memory_file` is the legacy memory_embeddings.json
+        and `vector_index_file` the legacy index file, only read when
+        migrating to the versioned vector store layout.
+        """
+        with self._write_lock:
+            return self._create_vector_database(dimension, memory_file, vector_index_file)
+
+    def _create_vector_database(self, dimension, memory_file, vector_index_file):
+        from vector_index import IdMappedIndex, memory_label, set_search_params
+        from vector_store import read_index_mmap
         print("Creating vector database from memories...")
+        if vector_index_file is not None:
+            self.vector_index_file = vector_index_file
+
+        # Any saved index is usable: reconciling by content hash fixes whatever drifted
+        row_ids = None
+        index_version = self._checkpoint['index_version']
+        index_file = self.vector_store.index_path(index_version) if index_version else self.vector_index_file
+        if index_version:
+            if self.vector_store.exists(index_version):
+                row_ids, row_hashes = self.vector_store.load(index_version)
+            else:
+                print(f"⚠️ Vector store version {index_version} is missing; rebuilding")
+        elif os.path.exists(self.vector_index_file):
+            if self.vector_store.exists():
+                row_ids, row_hashes = self.vector_store.load()
+            elif os.path.exists(memory_file):
+                # Legacy layout, rows ordered by index_position
+                with open(memory_file, 'r') as f:
+                    legacy_embeddings = json.load(f)
+                row_ids = sorted(legacy_embeddings, key=lambda mid: legacy_embeddings[mid]['index_position'])
+                row_hashes = [content_hash(legacy_embeddings[mid].get('content') or "") for mid in row_ids]
         
-        # Initialize FAISS index
-        self.vector_index = faiss.IndexFlatL2(dimension)
-        embeddings_list = []
-        memory_ids = []
+        if row_ids is not None:
+            row_ids = [str(memory_id) for memory_id in row_ids]
+            index, mapped = read_index_mmap(index_file)
+            if index.d != dimension or index.ntotal != len(row_ids):
+                print(f"⚠️ Saved vector index has {index.ntotal} rows of dimension {index.d}, "
+                      f"expected {len(row_ids)} of dimension {dimension}; rebuilding")
+                row_ids = None
         
-        if os.path.exists(vector_index_file) and os.path.exists(memory_file):
-            # Load existing vector index
-            self.vector_index = faiss.read_index(vector_index_file)
-            # Load existing memory embeddings
-            with open(memory_file, 'r') as f:
-                self.memory_embeddings = json.load(f)
-            print("Loaded existing vector index and memory embeddings.")
+        renormalized = False
+        if row_ids is not None and not self._checkpoint['normalized']:
+            # Indexes written before embeddings were L2-normalized hold raw vectors
+            index, renormalized = self._normalize_rows(index, dimension)
+            mapped = mapped and not renormalized
+
+        if row_ids is not None:
+            set_search_params(index, **self.search_params)
+            vector_index = IdMappedIndex(
+                dimension,
+                index=index,
+                row_labels=[memory_label(mid) for mid in row_ids],
+                row_keys=row_ids,
+                mapped=mapped,
+                auto_maintain=False
+            )
+            diff = self._reconcile(vector_index, row_ids, row_hashes)
+            self._journal_tail = []
+            with self._lock.write():
+                self.vector_index = vector_index
+            print(f"Loaded existing vector index ({self.vector_index.index_type}).")
+            self._maybe_maintain_index()
+            self._maybe_promote()
+            if any(diff.values()) or not self._checkpoint['normalized']:
+                # Persist the reconciled rows so the next start has nothing to do
+                self.checkpoint()
             return self.vector_index
         else:
-        # Generate embeddings for each memory
-            for memory in self.memories:
-                memory_id = memory.get('memory_id')
-                content = memory.get('content')
-                
-                if memory_id and content:
-                    embedding = self.embed_text(content)
-                    embeddings_list.append(embedding)
-                    memory_ids.append(memory_id)
-                    self.memory_embeddings[memory_id] = {
-                        'content': content,
-                        'index_position': len(embeddings_list) - 1
-                    }
+            vector_index = IdMappedIndex(dimension)
+            self._journal_tail = []
+            indexed = [memory for memory in self.memories if memory.memory_id and memory.content]
+            memory_ids = [memory.memory_id for memory in indexed]
+            contents = [memory.content for memory in indexed]
         
-        # Add all embeddings to FAISS index
-            if embeddings_list:
-                embeddings_matrix = np.vstack(embeddings_list)
-                self.vector_index.add(embeddings_matrix)
+        # Embed all memories in batches and add them to the FAISS index in one call
+            if memory_ids:
+                embeddings_matrix = self.embed_texts(contents, show_progress=True)
+                vector_index = IdMappedIndex(dimension, index=self._new_index(dimension, embeddings_matrix))
+                vector_index.add([memory_label(mid) for mid in memory_ids], embeddings_matrix, keys=memory_ids)
+            vector_index.auto_maintain = False
+            with self._lock.write():
+                self.vector_index = vector_index
         
-        print(f"Vector database created with {len(embeddings_list)} memories")
-        # Save the vector index to a file
-        faiss.write_index(self.vector_index, "memory_index.faiss")
-        # Save memory embeddings to a file
-        with open("memory_embeddings.json", 'w') as f:
-            json.dump(self.memory_embeddings, f, indent=2)
+        print(f"Vector database created with {len(memory_ids)} memories")
+        self.checkpoint()
             
         return self.vector_index
 
-    def similarity_search(self, query: str, k: int = 5):
+    def _reconcile(self, vector_index, row_ids, row_hashes):
+        """
+        Bring a loaded index in line with the memories by content hash: embed
+        only memories that are new or whose content changed since their row
+        was written, and drop rows of memories that no longer exist. Vectors
+        logged in the journal tail are reused rather than embedded again.
+        Returns the diff as lists of memory_ids.
+        """
+        from vector_index import memory_label
+        stored = {memory_id: bytes(row_hash) for memory_id, row_hash in zip(row_ids, row_hashes)}
+        current = {record.memory_id: record.content for record in self.memories if record.content}
+        removed = [memory_id for memory_id in stored if memory_id not in current]
+        added = [memory_id for memory_id in current if memory_id not in stored]
+        changed = [memory_id for memory_id, content in current.items()
+                   if memory_id in stored and stored[memory_id] != content_hash(content)]
+        stale = added + changed
+
+        logged = {entry['memory_id']: entry for entry in self._journal_tail if entry.get('vector') is not None}
+        vectors = {}
+        for memory_id in stale:
+            entry = logged.get(memory_id)
+            if entry is not None and entry['content'] == current[memory_id]:
+                vectors[memory_id] = decode_vector(entry['vector'])
+        to_embed = [memory_id for memory_id in stale if memory_id not in vectors]
+        if to_embed:
+            vectors.update(zip(to_embed, self.embed_texts([current[mid] for mid in to_embed], show_progress=True)))
+
+        vector_index.remove([memory_label(memory_id) for memory_id in removed])
+        if stale:
+            vector_index.add([memory_label(mid) for mid in stale], np.vstack([vectors[mid] for mid in stale]), keys=stale)
+
+        self.last_reconcile = {"added": added, "changed": changed, "removed": removed}
+        if stale or removed:
+            print(f"Reconciled vector index with memories: {len(added)} added, {len(changed)} changed, "
+                  f"{len(removed)} removed, {len(to_embed)} embedded")
+        return self.last_reconcile
+
+    def _normalize_rows(self, index, dimension):
+        """
+        Rebuild a loaded index from its L2-normalized rows if they are not
+        unit-norm already. Returns (index, whether it was rebuilt).
+        """
+        if index.ntotal == 0:
+            return index, False
+        vectors = index.reconstruct_n(0, index.ntotal)
+        norms = np.linalg.norm(vectors, axis=1)
+        if np.allclose(norms[norms > 0], 1.0, atol=1e-3):
+            return index, False
+        print(f"Normalizing {index.ntotal} stored vectors (norms {norms.min():.2f}-{norms.max():.2f})")
+        vectors = self._stack_normalized(vectors)
+        normalized = self._new_index(dimension, vectors)
+        normalized.add(vectors)
+        return normalized, True
+
+    def _new_index(self, dimension, vectors):
+        from vector_index import build_index, set_search_params
+        index_type = self.index_type if len(vectors) >= self.promote_at else "flat"
+        index = build_index(index_type, dimension, vectors, **self.index_params)
+        set_search_params(index, **self.search_params)
+        return index
+
+    def _maybe_promote(self):
+        if (self.index_type != "flat" and self.vector_index.index_type == "flat"
+                and self.vector_index.ntotal >= self.promote_at and self._promotion_thread is None):
+            self.promote_index()
+
+    def promote_index(self, background: bool = True):
+        """
+        Replace the flat index with an index of type `index_type`.
+
+        Training and adding run on a background thread against a snapshot of
+        the flat index; edits made meanwhile are replayed onto the new index
+        before it is swapped in, so searches keep using the flat index until then.
+        """
+        # row_labels() and friends compact in place, so snapshot a compacted version
+        with self._write_lock:
+            self._maybe_maintain_index(compact=True)
+            source = self.vector_index
+            labels = source.row_labels()
+            keys = source.row_keys()
+            vectors = source.vectors()
+            self._promotion_touched = set()
+
+        from vector_index import IdMappedIndex, build_index, memory_label, set_search_params
+
+        def build():
+            try:
+                print(f"Promoting vector index to {self.index_type} ({len(labels)} memories)...")
+                index = build_index(self.index_type, source.dimension, vectors, **self.index_params)
+                set_search_params(index, **self.search_params)
+                promoted = IdMappedIndex(source.dimension, index=index)
+                promoted.add(labels, vectors, keys=keys)
+                promoted.auto_maintain = False
+                with self._write_lock, self._lock.write():
+                    for memory_id in self._promotion_touched:
+                        label = memory_label(memory_id)
+                        promoted.remove([label])
+                        if label in self.vector_index:
+                            promoted.add([label], self.vector_index.reconstruct(label).reshape(1, -1), keys=[memory_id])
+                    self.vector_index = promoted
+                print(f"Vector index promoted to {self.index_type}")
+            finally:
+                with self._lock.write():
+                    self._promotion_touched = None
+                self._promotion_thread = None
+
+        if not background:
+            build()
+            return
+        self._promotion_thread = threading.Thread(target=build, name="index-promotion", daemon=True)
+        self._promotion_thread.start()
+
+    def save_vector_database(self, version: int, vector_index, memories):
+        """
+        Save a snapshot of the vector index as vector store `version`, with
+        the content hash of each row taken from the matching `memories`.
+        """
+        vector_index.compact()
+        contents = {memory['memory_id']: memory['content'] for memory in memories}
+        memory_ids = vector_index.row_keys()
+        hashes = [content_hash(contents[memory_id]) for memory_id in memory_ids]
+        self.vector_store.save(version, memory_ids, hashes, vector_index.index)
+
+    def checkpoint(self):
+        """
+        Compact the journal into a new versioned checkpoint.
+
+        Only snapshotting the memories and the index holds up writers; the
+        files are written from the snapshot while edits go on. The vector
+        index files go to a new vector store version and memories.json is
+        replaced through a temp file. Renaming the manifest into place then
+        commits the checkpoint, and only after that is the journal truncated
+        and the previous version deleted. A crash at any earlier step leaves
+        the previous manifest, whose index version is intact, plus a journal
+        that replays on top: replayed operations are idempotent upserts and
+        deletes, so they also bring a newer memories.json to the same state,
+        and reconciling by content hash covers the index.
+        """
+        with self._write_lock:
+            self._checkpoint_lock.acquire()
+            try:
+                seq = self.journal.last_seq
+                journal_offset = self.journal.size
+                records = self.memories.snapshot()
+                next_memory_number = self.memories.next_number
+                indexed = self.vector_index is not None
+                index = None
+                # An untouched memory-mapped index is the saved version already
+                if indexed and not (self.vector_index.mapped and self.vector_index.compacted
+                                    and self._checkpoint['index_version']):
+                    index = self.vector_index.snapshot()
+            except BaseException:
+                self._checkpoint_lock.release()
+                raise
+
+        try:
+            version = self._checkpoint['version'] + 1
+            memories = [record.to_dict() for record in records]
+            atomic_write(self.memories_file, json.dumps(memories, indent=2))
+            index_version = self._checkpoint['index_version']
+            if index is not None:
+                self.save_vector_database(version, index, memories)
+                index_version = version
+            self._checkpoint = {
+                "version": version,
+                "seq": seq,
+                "index_seq": seq if indexed else self._checkpoint['index_seq'],
+                "index_version": index_version,
+                "next_memory_number": next_memory_number,
+                # Index rows saved from a loaded index are L2-normalized
+                "normalized": indexed or self._checkpoint['normalized']
+            }
+            atomic_write(self.checkpoint_file, json.dumps(self._checkpoint, indent=2))
+            self.journal.truncate(seq, offset=journal_offset)
+            self.vector_store.prune(keep=index_version)
+        finally:
+            self._checkpoint_lock.release()
+
+    def _background_checkpoint(self):
+        try:
+            self.checkpoint()
+        except Exception as e:
+            print(f"⚠️ Background checkpoint failed, the journal keeps the operations: {e}")
+        finally:
+            self._checkpoint_thread = None
+
+    def close(self):
+        """
+        Checkpoint pending operations and release the journal, e.g. when a
+        shard is evicted. The Database must not be used afterwards.
+        """
+        self.wait_for_index()
+        for thread in (self._promotion_thread, self._checkpoint_thread):
+            if thread is not None:
+                thread.join()
+        if self.journal.pending:
+            self.checkpoint()
+        self.journal.close()
+        if self._owns_embedding_cache:
+            self.embedding_cache.close()
+
+    def similarity_search(self, query: str, k: int = 5, policy: RetrievalPolicy = None, mode: str = "vector"):
+        """
+        Return up to k memories closest to the query, best first. With a
+        policy, at most policy.max_k hits are fetched and then pruned by it.
+
+        `mode` is one of SEARCH_MODES: "vector" ranks by embedding distance,
+        "hybrid" fuses it with BM25 keyword scores, and "lexical" uses BM25
+        only, skipping the embedding call and the vector index entirely.
+        """
+        return self.similarity_search_many([query], k=k, policy=policy, mode=mode)[0]
+
+    def similarity_search_many(self, queries, k: int = 5, policy: RetrievalPolicy = None, mode: str = "vector"):
+        """
+        Search for several queries with one batched embedding call and one
+        matrix index search. Returns one result list per query.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        if mode == "lexical":
+            return self._search_lexical(queries, k, policy)
+        if self.vector_index is None:
+            self._ensure_vector_database()
+        if not queries:
+            return []
+        embeddings = self.embed_texts(queries)
+        if mode == "hybrid":
+            return self._search_hybrid(queries, embeddings, k, policy)
+        return self._search_embeddings(embeddings, k, policy)
+
+    def find_duplicate(self, content: str):
+        """memory_id of a memory with the same text up to case, whitespace and punctuation, or None."""
+        with self._lock.read():
+            return self.memories.find_by_content(content)
+
+    async def asimilarity_search(self, query: str, k: int = 5, policy: RetrievalPolicy = None, mode: str = "vector"):
+        """Async similarity_search; only the embedding call is awaited, the index search is in-process."""
+        return (await self.asimilarity_search_many([query], k=k, policy=policy, mode=mode))[0]
+
+    async def asimilarity_search_many(self, queries, k: int = 5, policy: RetrievalPolicy = None, mode: str = "vector"):
+        """Async similarity_search_many."""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        if mode == "lexical":
+            return self._search_lexical(queries, k, policy)
         if self.vector_index is None:
-            self.create_vector_database()
-        
-        query_embedding = self.embed_text(query).reshape(1, -1)
-        distances, indices = self.vector_index.search(query_embedding, k)
+            import asyncio
+            await self._await_index()
+            await asyncio.to_thread(self._ensure_vector_database)
+        if not queries:
+            return []
+        embeddings = await self.aembed_texts(queries)
+        if mode == "hybrid":
+            return self._search_hybrid(queries, embeddings, k, policy)
+        return self._search_embeddings(embeddings, k, policy)
+
+    def start_background_load(self, dimension=768):
+        """
+        Load or build the vector index on a background thread. Searches and
+        memory writes wait for it; the summary and recent messages are usable
+        right away.
+        """
+        if self.vector_index is not None or self._index_loader is not None:
+            return
+
+        def load():
+            try:
+                self.create_vector_database(dimension)
+            except Exception as e:
+                print(f"⚠️ Background index load failed, retrying on first search: {e}")
+
+        self._index_loader = threading.Thread(target=load, name="index-load", daemon=True)
+        self._index_loader.start()
+
+    def wait_for_index(self):
+        """Block until a load started by start_background_load has finished."""
+        loader = self._index_loader
+        if loader is not None:
+            loader.join()
+            self._index_loader = None
+
+    async def _await_index(self):
+        if self._index_loader is not None:
+            import asyncio
+            await asyncio.to_thread(self.wait_for_index)
+
+    def _ensure_vector_database(self):
+        self.wait_for_index()
+        with self._write_lock:
+            if self.vector_index is None:
+                self.create_vector_database()
+
+    def _search_embeddings(self, query_embeddings, k, policy):
+        if policy is not None:
+            k = policy.max_k
+        # Row keys are the memory_ids, so hydration is O(k) and stays correct after deletes.
+        # Index and metadata are read under one shared lock, so they always match.
+        with self._lock.read():
+            distances, memory_ids = self.vector_index.search_keys(query_embeddings, k)
+            contents = [[self.memories.get(memory_id).content if memory_id is not None else None
+                         for memory_id in row_ids] for row_ids in memory_ids]
+        scores = 1.0 / (1.0 + distances)
         
-        results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.memory_embeddings):
-                memory_data = list(self.memory_embeddings.values())[idx]
-                memory_id = list(self.memory_embeddings.keys())[idx]
-                results.append({
+        all_results = []
+        for row_ids, row_contents, row_scores, row_distances in zip(memory_ids, contents, scores, distances):
+            results = []
+            for memory_id, content, score, distance in zip(row_ids, row_contents, row_scores, row_distances):
+                if memory_id is not None:
+                    results.append({
+                        'memory_id': memory_id,
+                        'content': content,
+                        'score': score,
+                        'distance': distance
+                    })
+            if policy is not None:
+                results, _ = policy.apply(results)
+            all_results.append(results)
+        return all_results
+
+    def _search_lexical(self, queries, k, policy):
+        # BM25 only: works before the vector index has loaded
+        if policy is not None:
+            k = policy.max_k
+        all_results = []
+        with self._lock.read():
+            for query in queries:
+                results = [{
                     'memory_id': memory_id,
-                    'content': memory_data['content'],
-                    'score': 1.0 / (1.0 + distance),
-                    'distance': distance
-                })
-        
-        return results
+                    'content': self.memories.get(memory_id).content,
+                    'score': score,
+                    'distance': None
+                } for memory_id, score in self.lexical_index.search(query, k)]
+                if policy is not None:
+                    results, _ = policy.apply(results)
+                all_results.append(results)
+        return all_results
+
+    def _search_hybrid(self, queries, query_embeddings, k, policy):
+        """
+        Fuse vector and BM25 rankings: both draw a wider candidate pool, and
+        each candidate scores hybrid_alpha * cosine similarity plus the rest
+        times its BM25 score relative to the query's best. Keyword-only
+        candidates get their vector distance from the stored vector.
+        """
+        from vector_index import memory_label
+        if policy is not None:
+            k = policy.max_k
+        pool = 4 * k
+        all_results = []
+        with self._lock.read():
+            distances, memory_ids = self.vector_index.search_keys(query_embeddings, pool)
+            for query, embedding, row_distances, row_ids in zip(queries, query_embeddings, distances, memory_ids):
+                vector_hits = {memory_id: float(distance)
+                               for memory_id, distance in zip(row_ids, row_distances) if memory_id is not None}
+                lexical_hits = dict(self.lexical_index.search(query, pool))
+                best_lexical = max(lexical_hits.values(), default=0.0) or 1.0
+                results = []
+                for memory_id in dict.fromkeys([*vector_hits, *lexical_hits]):
+                    distance = vector_hits.get(memory_id)
+                    label = memory_label(memory_id)
+                    if distance is None and label in self.vector_index:
+                        distance = float(np.sum((self.vector_index.reconstruct(label) - embedding) ** 2))
+                    # Squared L2 between unit vectors is 2 - 2*cosine
+                    similarity = max(0.0, 1.0 - distance / 2) if distance is not None else 0.0
+                    results.append({
+                        'memory_id': memory_id,
+                        'content': self.memories.get(memory_id).content,
+                        'score': self.hybrid_alpha * similarity
+                                 + (1 - self.hybrid_alpha) * lexical_hits.get(memory_id, 0.0) / best_lexical,
+                        'distance': distance
+                    })
+                results.sort(key=lambda result: result['score'], reverse=True)
+                results = results[:k]
+                if policy is not None:
+                    results, _ = policy.apply(results)
+                all_results.append(results)
+        return all_results
 
     def _get_next_memory_id(self):
-        if not self.memories:
-            return "mem_001"
-        
-        existing_ids = [int(mem['memory_id'].split('_')[1]) for mem in self.memories if mem['memory_id'].startswith('mem_')]
-        next_id = max(existing_ids) + 1
-        return f"mem_{next_id:03d}"
+        return self.memories.allocate_id()
 
     def _save_memories_to_file(self):
-        with open(self.memories_file, 'w') as f:
-            json.dump(self.memories, f, indent=2)
+        atomic_write(self.memories_file, json.dumps(self.memories.to_list(), indent=2))
 
     def _rebuild_vector_index(self):
         if self.vector_index is not None:
-            self.create_vector_database()
+            self.checkpoint()
+
+    def _apply_to_memories(self, entry):
+        operation = entry['op']
+        memory_id = entry['memory_id']
+        if operation == "DELETE":
+            self.memories.remove(memory_id)
+            self.lexical_index.remove(memory_id)
+        elif operation == "ADD" or memory_id in self.memories:
+            self.memories.upsert(memory_id, entry['content'], entry['updated_date'])
+            self.lexical_index.add(memory_id, entry['content'])
+
+    def _edit_index(self, operation, memory_id, embedding):
+        # Caller holds _lock for writing
+        from vector_index import memory_label
+        if operation == "DELETE":
+            self.vector_index.remove([memory_label(memory_id)])
+        else:
+            self.vector_index.add([memory_label(memory_id)], embedding.reshape(1, -1), keys=[memory_id])
+        if self._promotion_touched is not None:
+            self._promotion_touched.add(memory_id)
+
+    def _maybe_maintain_index(self, compact: bool = False):
+        """
+        Run a due buffer merge or compaction, or a full compaction with
+        `compact`, on a copy of the index and swap the new version in, so
+        searches keep using the current one meanwhile. Caller holds
+        _write_lock, so no edit can land between copy and swap.
+        """
+        if compact and not self.vector_index.compacted:
+            maintained = self.vector_index.copy()
+            maintained.compact()
+        elif self.vector_index.needs_maintenance():
+            maintained = self.vector_index.copy()
+            maintained.maintain()
+        else:
+            return
+        with self._lock.write():
+            self.vector_index = maintained
+
+    def _commit(self, operation: str, memory_id: str, content: str = None, updated_date: str = None, embedding=None):
+        """
+        Append one operation to the journal, then apply it in memory. The
+        metadata and index edits become visible to searches together; an
+        append that fails leaves them untouched.
+        """
+        entry = {"op": operation, "memory_id": memory_id, "content": content, "updated_date": updated_date}
+        with self._write_lock:
+            self.journal.append(operation, memory_id, content, updated_date, embedding)
+            # An UPDATE racing a DELETE of the same memory must not re-index it
+            index_edit = self.vector_index is not None and (
+                operation == "DELETE" or (embedding is not None and (operation == "ADD" or memory_id in self.memories))
+            )
+            with self._lock.write():
+                self._apply_to_memories(entry)
+                if index_edit:
+                    self._edit_index(operation, memory_id, embedding)
+                self.write_version += 1
+            if index_edit:
+                self._maybe_maintain_index()
+                self._maybe_promote()
+
+    def _maybe_checkpoint(self):
+        # Caller holds _write_lock, so at most one checkpoint thread is started
+        if self._checkpoint_thread is not None:
+            return
+        if self.journal.pending >= max(self.checkpoint_every, self.checkpoint_ratio * len(self.memories)):
+            self._checkpoint_thread = threading.Thread(target=self._background_checkpoint, name="checkpoint",
+                                                       daemon=True)
+            self._checkpoint_thread.start()
 
     def add_memory(self, content: str, updated_date: str = None):
         if updated_date is None:
             from datetime import datetime
             updated_date = datetime.now().isoformat()
         
-        memory_id = self._get_next_memory_id()
-        
-        new_memory = {
-            "memory_id": memory_id,
-            "updated_date": updated_date,
-            "content": content
-        }
+        self.wait_for_index()
+        embedding = self.embed_text(content) if self.vector_index is not None else None
+        return self._add_embedded(content, updated_date, embedding)
+
+    async def aadd_memory(self, content: str, updated_date: str = None):
+        """
+        Async add_memory. The embedding is awaited; the commit, which may
+        wait on a writer or a checkpoint, runs in a worker thread so the
+        event loop keeps serving other sessions.
+        """
+        if updated_date is None:
+            from datetime import datetime
+            updated_date = datetime.now().isoformat()
         
-        self.memories.append(new_memory)
-        self._save_memories_to_file()
+        import asyncio
+        await self._await_index()
+        embedding = (await self.aembed_texts([content]))[0] if self.vector_index is not None else None
+        return await asyncio.to_thread(self._add_embedded, content, updated_date, embedding)
+
+    def _add_embedded(self, content, updated_date, embedding):
+        with self._write_lock:
+            memory_id = self._get_next_memory_id()
+            self._commit("ADD", memory_id, content, updated_date, embedding)
+            self._maybe_checkpoint()
+        return memory_id
+
+    def add_memories(self, contents, updated_date: str = None):
+        """
+        Add several memories at once, embedding them in one batched call.
+        Returns the new memory ids.
+        """
+        if updated_date is None:
+            from datetime import datetime
+            updated_date = datetime.now().isoformat()
         
-        if self.vector_index is not None:
-            embedding = self.embed_text(content)
-            self.vector_index.add(embedding.reshape(1, -1))
-            self.memory_embeddings[memory_id] = {
-                'content': content,
-                'index_position': len(self.memory_embeddings)
-            }
-            
+        self.wait_for_index()
+        embeddings = self.embed_texts(contents) if self.vector_index is not None and contents else [None] * len(contents)
+        memory_ids = []
+        with self._write_lock:
+            for content, embedding in zip(contents, embeddings):
+                memory_id = self._get_next_memory_id()
+                self._commit("ADD", memory_id, content, updated_date, embedding)
+                memory_ids.append(memory_id)
+            self._maybe_checkpoint()
+        return memory_ids
 
     def update_memory(self, memory_id: str, new_content: str, updated_date: str = None):
         if updated_date is None:
             from datetime import datetime
             updated_date = datetime.now().isoformat()
         
-        for memory in self.memories:
-            if memory['memory_id'] == memory_id:
-                memory['content'] = new_content
-                memory['updated_date'] = updated_date
-                break
-        
-        self._save_memories_to_file()
+        self.wait_for_index()
+        embedding = None
+        if self._is_indexed(memory_id):
+            embedding = self.embed_text(new_content)
+        self._update_embedded(memory_id, new_content, updated_date, embedding)
+
+    async def aupdate_memory(self, memory_id: str, new_content: str, updated_date: str = None):
+        """Async update_memory."""
+        if updated_date is None:
+            from datetime import datetime
+            updated_date = datetime.now().isoformat()
         
-        if memory_id in self.memory_embeddings:
-            new_embedding = self.embed_text(new_content)
-            position = self.memory_embeddings[memory_id]['index_position']
-            
-            all_embeddings = []
-            for i in range(self.vector_index.ntotal):
-                if i == position:
-                    all_embeddings.append(new_embedding)
-                else:
-                    old_embedding = self.vector_index.reconstruct(i)
-                    all_embeddings.append(old_embedding)
-            
-            self.vector_index = faiss.IndexFlatL2(len(new_embedding))
-            embeddings_matrix = np.vstack(all_embeddings)
-            self.vector_index.add(embeddings_matrix)
-            
-            self.memory_embeddings[memory_id]['content'] = new_content
+        import asyncio
+        await self._await_index()
+        embedding = None
+        if self._is_indexed(memory_id):
+            embedding = (await self.aembed_texts([new_content]))[0]
+        await asyncio.to_thread(self._update_embedded, memory_id, new_content, updated_date, embedding)
+
+    def _is_indexed(self, memory_id):
+        from vector_index import memory_label
+        return self.vector_index is not None and memory_label(memory_id) in self.vector_index
+
+    def _update_embedded(self, memory_id, new_content, updated_date, embedding):
+        with self._write_lock:
+            self._commit("UPDATE", memory_id, new_content, updated_date, embedding)
+            self._maybe_checkpoint()
 
     def delete_memory(self, memory_id: str):
-        if memory_id not in self.memory_embeddings:
-            return
-        
-        delete_position = self.memory_embeddings[memory_id]['index_position']
-        
-        self.memories = [memory for memory in self.memories if memory['memory_id'] != memory_id]
-        self._save_memories_to_file()
-        
-        all_embeddings = []
-        new_memory_embeddings = {}
-        new_position = 0
-        
-        for old_position in range(self.vector_index.ntotal):
-            if old_position != delete_position:
-                old_embedding = self.vector_index.reconstruct(old_position)
-                all_embeddings.append(old_embedding)
-                
-                for mem_id, mem_data in self.memory_embeddings.items():
-                    if mem_data['index_position'] == old_position:
-                        new_memory_embeddings[mem_id] = {
-                            'content': mem_data['content'],
-                            'index_position': new_position
-                        }
-                        new_position += 1
-                        break
-        
-        if all_embeddings:
-            self.vector_index = faiss.IndexFlatL2(len(all_embeddings[0]))
-            embeddings_matrix = np.vstack(all_embeddings)
-            self.vector_index.add(embeddings_matrix)
-        else:
-            self.vector_index = faiss.IndexFlatL2(768)
-        
-        self.memory_embeddings = new_memory_embeddings
+        self.wait_for_index()
+        with self._write_lock:
+            self._commit("DELETE", memory_id)
+            self._maybe_checkpoint()
+
+    async def adelete_memory(self, memory_id: str):
+        """Async delete_memory."""
+        import asyncio
+        await self._await_index()
+        await asyncio.to_thread(self.delete_memory, memory_id)
 
 if __name__ == "__main__":
     db = Database()
@@ -0,0 +1,115 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of text embeddings keyed by (model, sha256(text)).
+
+    Lookups go to a bounded in-memory LRU first and then to an sqlite file,
+    so repeated text and cold index rebuilds never reach the embedding server
+    twice for the same content.
+    """
+
+    def __init__(self, path: str = "./embedding_cache.sqlite", max_memory_items: int = 10000):
+        """
+        Args:
+            path: sqlite file for the on-disk tier, or None to keep the cache in memory only.
+            max_memory_items: Number of embeddings kept in the in-memory LRU tier.
+        """
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, model: str, text: str):
+        """Return the cached embedding as a float32 array, or None on a miss."""
+        key = (model, self.text_hash(text))
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND text_hash = ?", key
+                ).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, vector):
+        """Store an embedding in both tiers."""
+        key = (model, self.text_hash(text))
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    (key[0], key[1], vector.tobytes())
+                )
+                self._conn.commit()
+
+    def put_many(self, model: str, texts, vectors):
+        """Store a batch of embeddings with a single disk commit."""
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = (model, self.text_hash(text))
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key[0], key[1], vector.tobytes()))
+            if self._conn is not None:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)", rows
+                )
+                self._conn.commit()
+
+    def stats(self):
+        """Hit/miss counters since the cache was opened."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,5 +1,6 @@
 from prompts import form_extraction_prompt
 from prompts import create_summary_prompt
+from shards import alease_database, lease_database, resolve_database
 class Extraction:
     """
     Represents the Extraction Phase of the Mem0 system.
@@ -9,68 +10,130 @@ class Extraction:
     memories from the exchange.
     """
 
-    def __init__(self, llm, db, recency_window_m: int = 2, update_summary_after: int = 10):
+    def __init__(self, llm, db, recency_window_m: int = 2, update_summary_after: int = 10, user_id: str = None):
         """
         Args:
-            llm: An Ollama-compatible LLM instance with a .predict(prompt) or .invoke(prompt) method.
-            db: Database interface for fetching summaries and recent messages.
+            llm: An Ollama-compatible LLM instance with a .predict(prompt, phase=None, raise_errors=False) method.
+            db: Database interface for fetching summaries and recent messages, or a ShardManager.
             recency_window_m: Number of recent messages to include as context.
+            user_id: Selects the user's shard when `db` is a ShardManager.
         """
         self.llm = llm
         self.update_summary_after = update_summary_after
         self.messages_count = 0 
-        self.db = db
+        self._db = db
+        self.user_id = user_id
         self.recency_window_m = recency_window_m
 
         #self.generate_summary()
 
+    @property
+    def db(self):
+        return resolve_database(self._db, self.user_id)
+
+    def lease(self):
+        """Context manager keeping the user's shard open, so it is not evicted mid-call."""
+        return lease_database(self._db, self.user_id)
+
+    def alease(self):
+        """Async lease(); a cold shard is loaded off the event loop."""
+        return alease_database(self._db, self.user_id)
+
     def generate_summary(self):
         """
         Generates a summary of the conversation using the LLM.
         This method is not used in the current extraction workflow but can be implemented if needed.
         """
         # Takes memories content and passes to LLM to generate a summary
-        prompt = create_summary_prompt(self.db.memories)
+        with self.lease() as db:
+            summary = self.llm.predict(self._summary_prompt(db), phase="summary", raise_errors=True)
+            self._store_summary(db, summary)
+
+    async def agenerate_summary(self):
+        """Async generate_summary"""
+        async with self.alease() as db:
+            summary = await self.llm.apredict(self._summary_prompt(db), phase="summary", raise_errors=True)
+            self._store_summary(db, summary)
 
-        print(f"Generating Summary of past context please wait it takes time ......")
-        summary = self.llm.predict(prompt) 
+    def _summary_prompt(self, db):
+        prompt = create_summary_prompt(db.memories)
+        print("Generating Summary of past context please wait it takes time ......")
+        return prompt
 
-        self.db.conversation_summary = summary
-        self.db.save_summary()
+    def _store_summary(self, db, summary):
+        db.conversation_summary = summary
+        db.save_summary()
         print(f"Generated Summary: {summary}")
 
     def assemble_context(self):
         """
         Gathers the conversation summary and recent messages for context.
         """
+        with self.lease() as db:
+            return self._context(db)
+
+    def _context(self, db):
         # Retrieve the most recent conversation summary (S)
-        summary = self.db.conversation_summary
+        summary = db.conversation_summary
         # Retrieve the last m messages (excluding the current pair)
-        recent_messages = self.db.get_recent_messages(self.recency_window_m)
+        recent_messages = db.get_recent_messages(self.recency_window_m)
         return summary, recent_messages
-    
 
-    def extract_memories(self, mt_1, mt):
+    def extract_memories(self, mt_1, mt, earlier_turns=()):
         """
-        Main extraction workflow for a new message pair.
+        Main extraction workflow for a new message pair. `earlier_turns` are
+        (user, assistant) pairs before it that were not extracted yet.
         """
 
         summary, recent_messages = self.assemble_context()
         
         # Step 2: Form prompt
-        prompt = form_extraction_prompt(summary, recent_messages, mt_1, mt)
-        print(prompt)
+        prompt = self._extraction_prompt(summary, recent_messages, mt_1, mt, earlier_turns)
         # Step 3: LLM extraction (Ollama model)
-        # If your LLM is async, use: memories = await self.llm.invoke(prompt)
-        memories = self.llm.predict(prompt)
-        print(memories)
-        if "<none>" in memories:
-            return []
-        if self.messages_count >= self.update_summary_after:
+        # For async LLMs use aextract_memories
+        extracted = self._extracted(self.llm.predict(prompt, phase="extraction", raise_errors=True))
+        if extracted and self.messages_count >= self.update_summary_after:
             # Update the summary after a certain number of messages
             self.generate_summary()
             self.messages_count = 0
 
+        return extracted
+
+    def extract_memories_many(self, turns):
+        """
+        Extract memories from several consecutive (user, assistant) turns
+        with one LLM call, e.g. turns that queued up for background ingestion.
+        """
+        *earlier_turns, (mt_1, mt) = turns
+        return self.extract_memories(mt_1, mt, earlier_turns)
+
+    async def aextract_memories(self, mt_1, mt, earlier_turns=()):
+        """
+        Async extract_memories; the LLM calls are awaited.
+        """
+        async with self.alease() as db:
+            summary, recent_messages = self._context(db)
+        prompt = self._extraction_prompt(summary, recent_messages, mt_1, mt, earlier_turns)
+        extracted = self._extracted(await self.llm.apredict(prompt, phase="extraction", raise_errors=True))
+        if extracted and self.messages_count >= self.update_summary_after:
+            await self.agenerate_summary()
+            self.messages_count = 0
+
+        return extracted
+
+    def _extraction_prompt(self, summary, recent_messages, mt_1, mt, earlier_turns):
+        prompt = form_extraction_prompt(summary, recent_messages, mt_1, mt, earlier_turns)
+        print(prompt)
+        return prompt
+
+    def _extracted(self, memories):
+        """Facts in an extraction reply; empty when the LLM found none."""
+        print(memories)
+        if "<none>" in memories:
+            return []
+        return self._parse_memories(memories)
+
+    def _parse_memories(self, memories):
         if isinstance(memories, str):
             # Simple parsing: split by lines or bullets
             extracted = [line.strip("- ").strip() for line in memories.strip().splitlines() if line.strip()]
@@ -0,0 +1,218 @@
+import sqlite3
+import threading
+
+
+class IngestionQueue:
+    """
+    Persistent FIFO of conversation turns waiting for memory extraction.
+
+    Turns live in an sqlite file until they are acknowledged, so turns
+    accepted before a crash or restart are still ingested afterwards. Rows
+    are tagged with the user_id, so users can share one file.
+    """
+
+    def __init__(self, path: str = "./ingestion_queue.sqlite", user_id: str = None):
+        """
+        Args:
+            path: sqlite file holding the queued turns.
+            user_id: Only this user's turns are read and written.
+        """
+        self.path = path
+        self.user_id = user_id or ""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+            "user_message TEXT NOT NULL, assistant_message TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM turns WHERE user_id = ?", (self.user_id,)).fetchone()[0]
+
+    def put(self, user_message: str, assistant_message: str) -> int:
+        """Queue one turn and return its id; it is on disk when this returns."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO turns (user_id, user_message, assistant_message) VALUES (?, ?, ?)",
+                (self.user_id, user_message, assistant_message)
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def peek(self, limit: int):
+        """The oldest `limit` turns as (id, user_message, assistant_message, attempts), without removing them."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, user_message, assistant_message, attempts FROM turns WHERE user_id = ? ORDER BY id LIMIT ?",
+                (self.user_id, limit)
+            ).fetchall()
+
+    def ack(self, turn_ids):
+        """Remove turns that were ingested (or given up on)."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM turns WHERE id = ?", [(turn_id,) for turn_id in turn_ids])
+            self._conn.commit()
+
+    def record_failure(self, turn_ids):
+        with self._lock:
+            self._conn.executemany("UPDATE turns SET attempts = attempts + 1 WHERE id = ?",
+                                   [(turn_id,) for turn_id in turn_ids])
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class IngestionWorker:
+    """
+    Runs memory extraction and the update phase for queued turns on a
+    background thread, so chat() can return as soon as the reply exists.
+
+    Turns that queue up while the worker is busy are extracted together in
+    one LLM call. submit() blocks once max_pending turns are waiting, so a
+    slow model cannot let the backlog grow without bound. A failing batch
+    is retried with backoff and dropped after max_attempts; failures to
+    reach Ollama at all are retried without counting, so an outage never
+    drops turns.
+    """
+
+    def __init__(self, extractor, update_phase, queue: IngestionQueue, max_pending: int = 32,
+                 max_batch: int = 4, max_attempts: int = 3, retry_delay: float = 1.0):
+        """
+        Args:
+            extractor: Extraction used for the queued turns.
+            update_phase: UpdatePhase applying the extracted facts.
+            queue: Persistent queue; turns left in it by an earlier run are ingested first.
+            max_pending: Queued turns at which submit() starts blocking.
+            max_batch: Most consecutive turns extracted with one LLM call.
+            max_attempts: Failures after which a batch is dropped; connection errors and timeouts do not count.
+            retry_delay: Seconds before the first retry, doubled per failure.
+        """
+        self.extractor = extractor
+        self.update_phase = update_phase
+        self.queue = queue
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stats = {"turns": 0, "batches": 0, "failures": 0, "dropped": 0}
+        self._cond = threading.Condition()
+        self._pending = len(queue)
+        self._closing = False
+        self._stopping = False
+        if self._pending:
+            print(f"📥 Resuming memory ingestion of {self._pending} queued turns")
+        self._thread = threading.Thread(target=self._run, name="memory-ingestion", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """Turns queued or being ingested."""
+        return self._pending
+
+    def submit(self, user_message: str, assistant_message: str, timeout: float = None) -> bool:
+        """
+        Queue a turn for ingestion. Blocks while max_pending turns are
+        waiting; returns False if the queue is still full after `timeout`.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending < self.max_pending or self._stopping, timeout):
+                return False
+            if self._stopping:
+                raise RuntimeError("IngestionWorker is closed")
+            self.queue.put(user_message, assistant_message)
+            self._pending += 1
+            self._cond.notify_all()
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every turn submitted so far is ingested; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def close(self, drain: bool = True, timeout: float = None):
+        """
+        Stop the worker. With `drain` the queued turns are ingested first,
+        unless ingestion is failing: then, like without `drain`, they stay on
+        disk for the next start.
+        """
+        with self._cond:
+            # Cuts a retry backoff short; the next failure stops the worker
+            self._closing = True
+            self._cond.notify_all()
+        if drain and self._pending:
+            print(f"⏳ Saving memories from {self._pending} pending turns...")
+            with self._cond:
+                self._cond.wait_for(lambda: not self._pending or self._stopping, timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.queue.close()
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if self._stopping:
+                    return
+            turns = self.queue.peek(self.max_batch)
+            if not turns:
+                # Another worker on the same file took them
+                with self._cond:
+                    self._pending = 0
+                    self._cond.notify_all()
+                continue
+            turn_ids = [turn[0] for turn in turns]
+            try:
+                self._ingest([(turn[1], turn[2]) for turn in turns])
+            except Exception as e:
+                failures += 1
+                self.stats["failures"] += 1
+                expired = []
+                if not _is_outage(e):
+                    self.queue.record_failure(turn_ids)
+                    expired = [turn[0] for turn in turns if turn[3] + 1 >= self.max_attempts]
+                if not expired:
+                    delay = min(self.retry_delay * 2 ** (failures - 1), 60.0)
+                    with self._cond:
+                        if self._closing:
+                            print(f"⏸️ Memory ingestion failed, leaving {self._pending} turns queued for the next start: {e}")
+                            self._stopping = True
+                            self._cond.notify_all()
+                            return
+                        print(f"❌ Memory ingestion failed, retrying in {delay:g}s: {e}")
+                        self._cond.wait_for(lambda: self._closing or self._stopping, delay)
+                    continue
+                print(f"❌ Memory ingestion failed {self.max_attempts} times, dropping {len(expired)} turns: {e}")
+                self.stats["dropped"] += len(expired)
+                turn_ids = expired
+            else:
+                self.stats["turns"] += len(turn_ids)
+                self.stats["batches"] += 1
+            failures = 0
+            self.queue.ack(turn_ids)
+            with self._cond:
+                self._pending -= len(turn_ids)
+                self._cond.notify_all()
+
+    def _ingest(self, turns):
+        memories = self.extractor.extract_memories_many(turns)
+        if memories == []:
+            print("No new memories extracted.")
+            return
+        self.update_phase.process_extracted_memories(memories)
+
+
+def _is_outage(error: Exception) -> bool:
+    """True when Ollama could not be reached or timed out, rather than failing on the turns themselves."""
+    import httpx
+    import requests
+    return isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError,
+                              requests.ConnectionError, requests.Timeout))
@@ -0,0 +1,141 @@
+import base64
+import json
+import os
+import threading
+import numpy as np
+
+
+def atomic_write(path: str, data: str):
+    """Write a text file through a temp file and rename, so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def encode_vector(vector) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class MemoryJournal:
+    """
+    Append-only JSONL log of ADD/UPDATE/DELETE operations.
+
+    Every entry carries a sequence number and, when the memory was indexed,
+    its embedding, so replaying the log restores both the metadata and the
+    vector index without calling the embedding server. Operations are
+    idempotent upserts/removals, so replaying an entry that already reached a
+    checkpoint is harmless.
+    """
+
+    def __init__(self, path: str = "./memory_journal.jsonl", fsync: bool = False):
+        """
+        Args:
+            path: JSONL file the operations are appended to.
+            fsync: fsync after every append instead of only flushing.
+        """
+        self.path = path
+        self.fsync = fsync
+        self.last_seq = 0
+        self.pending = 0
+        # Bytes of complete entries in the file
+        self.size = 0
+        # Appends may run while a background checkpoint truncates
+        self._lock = threading.Lock()
+
+        valid_bytes = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    if not line.endswith(b"\n"):
+                        break
+                    valid_bytes += len(line)
+                    self.last_seq = entry['seq']
+                    self.pending += 1
+            # Drop a torn tail left by a crash mid-append
+            if os.path.getsize(path) > valid_bytes:
+                os.truncate(path, valid_bytes)
+        self.size = valid_bytes
+        self._file = open(path, 'a')
+
+    def append(self, operation: str, memory_id: str, content: str = None, updated_date: str = None,
+               vector=None) -> int:
+        """Append one operation and return its sequence number."""
+        encoded = encode_vector(vector) if vector is not None else None
+        with self._lock:
+            entry = {
+                "seq": self.last_seq + 1,
+                "op": operation,
+                "memory_id": memory_id,
+                "content": content,
+                "updated_date": updated_date,
+                "vector": encoded
+            }
+            # ASCII-only JSON, so characters and bytes line up
+            line = json.dumps(entry) + "\n"
+            try:
+                self._file.write(line)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except OSError:
+                # Cut off a partly written entry so later appends stay readable
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                os.truncate(self.path, self.size)
+                self._file = open(self.path, 'a')
+                raise
+            self.last_seq += 1
+            self.pending += 1
+            self.size += len(line)
+            return self.last_seq
+
+    def replay(self, after_seq: int = 0):
+        """Yield the logged entries with a sequence number above `after_seq`."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    return
+                if entry['seq'] > after_seq:
+                    yield entry
+
+    def truncate(self, seq: int, offset: int = None):
+        """
+        Drop the entries up to and including `seq` once they are checkpointed.
+
+        `offset` is the journal's size when `seq` was its last entry; with
+        it, the entries appended since are copied over without parsing the
+        checkpointed ones.
+        """
+        with self._lock:
+            if offset is None:
+                remaining = "".join(json.dumps(entry) + "\n" for entry in self.replay(after_seq=seq))
+            else:
+                with open(self.path, 'rb') as f:
+                    f.seek(offset)
+                    remaining = f.read(self.size - offset).decode('ascii')
+            self._file.close()
+            atomic_write(self.path, remaining)
+            self._file = open(self.path, 'a')
+            self.pending = remaining.count("\n")
+            self.size = len(remaining)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,88 @@
+import heapq
+import math
+import re
+from collections import Counter
+from operator import itemgetter
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str):
+    """Lowercased word tokens; punctuation separates terms."""
+    return _TOKEN.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    In-process inverted index over memory contents, scored with BM25.
+
+    Documents are added, replaced and removed one at a time in O(terms), so
+    it is kept in step with every memory write instead of being rebuilt.
+    Searching needs no embedding, which makes exact-term lookups local.
+    Not thread-safe; Database guards it with the same lock as the memories.
+    """
+
+    def __init__(self, documents=(), k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            documents: Initial (doc_id, text) pairs.
+            k1: Term frequency saturation.
+            b: Strength of document length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+        # term -> {doc_id: term frequency}
+        self._postings = {}
+        # doc_id -> distinct terms, so a document can be removed without its text
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+        for doc_id, text in documents:
+            self.add(doc_id, text)
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_lengths
+
+    def add(self, doc_id, text: str):
+        """Index a document, replacing any earlier version with the same id."""
+        self.remove(doc_id)
+        frequencies = Counter(tokenize(text or ""))
+        for term, frequency in frequencies.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+        self._doc_terms[doc_id] = tuple(frequencies)
+        length = sum(frequencies.values())
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id) -> bool:
+        """Drop a document; returns whether it was indexed."""
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return False
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        return True
+
+    def search(self, query: str, k: int = 5):
+        """Return up to k (doc_id, score) pairs containing a query term, best first."""
+        documents = len(self._doc_lengths)
+        if not documents:
+            return []
+        average_length = self._total_length / documents or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                norm = frequency + self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
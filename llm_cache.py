@@ -0,0 +1,138 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Two-tier cache of LLM responses keyed by (model, temperature, options,
+    phase, sha256(prompt)).
+
+    Lookups go to a bounded in-memory LRU first and then to an sqlite file.
+    Entries older than `ttl` count as misses, and every 100 writes the file
+    is trimmed to the max_disk_items most recently used entries. Replaying
+    a conversation log through extraction and update then costs no
+    generations for prompts seen before. OllamaLLM only consults it for the
+    phases in its cache_phases.
+    """
+
+    def __init__(self, path: str = "./llm_cache.sqlite", max_memory_items: int = 1000,
+                 max_disk_items: int = 100000, ttl: float = 7 * 24 * 3600):
+        """
+        Args:
+            path: sqlite file for the on-disk tier, or None to keep the cache in memory only.
+            max_memory_items: Number of responses kept in the in-memory LRU tier.
+            max_disk_items: Number of responses kept on disk; the least recently used go first.
+            ttl: Seconds a response stays valid, or None to keep it until evicted.
+        """
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl = ttl
+        # key -> (response, created_at)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_trim = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._conn.commit()
+
+    @staticmethod
+    def key(model: str, temperature: float, options: dict, phase: str, prompt: str) -> str:
+        """Cache key of one generation request."""
+        params = json.dumps({"model": model, "temperature": temperature, "options": options or {}, "phase": phase},
+                            sort_keys=True)
+        return hashlib.sha256(f"{params}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _remember(self, key, response, created_at):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """Return the cached response, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        self._remember(key, row[0], row[1])
+                        self.disk_hits += 1
+                        return row[0]
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str):
+        """Store a response in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now)
+                )
+                self._puts_since_trim += 1
+                if self._puts_since_trim >= 100:
+                    self._trim(now)
+                self._conn.commit()
+
+    def _trim(self, now: float):
+        # Caller holds _lock
+        self._puts_since_trim = 0
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_items,)
+        )
+
+    def stats(self):
+        """Hit/miss counters since the cache was opened."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
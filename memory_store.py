@@ -0,0 +1,171 @@
+import hashlib
+import re
+from itertools import islice
+
+_WORD = re.compile(r"\w+")
+
+
+class MemoryRecord:
+    """
+    One memory's metadata. Slotted to keep per-memory overhead small; item
+    access (record['content'], record.get(...)) still works for code written
+    against the plain dicts of memories.json.
+    """
+
+    __slots__ = ("memory_id", "updated_date", "content")
+
+    def __init__(self, memory_id: str, updated_date: str = None, content: str = None):
+        self.memory_id = memory_id
+        self.updated_date = updated_date
+        self.content = content
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        return {"memory_id": self.memory_id, "updated_date": self.updated_date, "content": self.content}
+
+
+def parse_memory_number(memory_id: str):
+    """42 for "mem_042", None for ids not allocated by MemoryStore."""
+    if memory_id.startswith("mem_") and memory_id[4:].isdigit():
+        return int(memory_id[4:])
+    return None
+
+
+def normalize_content(content: str) -> str:
+    """
+    Text with case, whitespace and punctuation ignored, so "User likes tea."
+    and "user likes  tea" normalize the same.
+    """
+    return " ".join(_WORD.findall((content or "").lower()))
+
+
+def content_key(content: str) -> int:
+    """64 bits of the normalized text's digest; a small int keeps the content index compact."""
+    return _key(normalize_content(content))
+
+
+def _key(normalized: str) -> int:
+    return int.from_bytes(hashlib.sha1(normalized.encode('utf-8')).digest()[:8], 'big')
+
+
+class MemoryStore:
+    """
+    memory_id -> MemoryRecord in insertion order, plus a monotonic counter
+    for new ids. Lookup, upsert, delete and id allocation are all O(1); the
+    counter is persisted with the checkpoint, so ids are never reused even
+    after the newest memory is deleted. Memories are also indexed by
+    content_key, so exact duplicates are found without a search.
+    """
+
+    def __init__(self, records=(), next_number: int = 1):
+        """
+        Args:
+            records: Memory dicts as stored in memories.json.
+            next_number: Persisted counter; raised past any id already in use.
+        """
+        self._records = {}
+        # content_key -> id of the memory with that normalized text, or a set
+        # of ids in the rare case several share it (duplicates, key collisions)
+        self._by_content = {}
+        self.next_number = next_number
+        for record in records:
+            self.upsert(record['memory_id'], record.get('content'), record.get('updated_date'))
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def __contains__(self, memory_id):
+        return memory_id in self._records
+
+    def __getitem__(self, index):
+        """Positional access in insertion order, for callers that treated memories as a list."""
+        if isinstance(index, slice) and index.step is None and index.stop is None \
+                and index.start is not None and index.start < 0:
+            # memories[-n:] only walks the last n records
+            return list(islice(reversed(self._records.values()), -index.start))[::-1]
+        return list(self._records.values())[index]
+
+    def get(self, memory_id: str):
+        return self._records.get(memory_id)
+
+    def find_by_content(self, content: str):
+        """memory_id of a memory whose normalized text equals content's, or None."""
+        normalized = normalize_content(content)
+        memory_ids = self._by_content.get(_key(normalized))
+        if memory_ids is None:
+            return None
+        for memory_id in ((memory_ids,) if isinstance(memory_ids, str) else memory_ids):
+            # Keys are only 64 bits, so confirm the text itself
+            if normalize_content(self._records[memory_id].content) == normalized:
+                return memory_id
+        return None
+
+    def _index_content(self, record: MemoryRecord):
+        key = content_key(record.content)
+        memory_ids = self._by_content.get(key)
+        if memory_ids is None:
+            self._by_content[key] = record.memory_id
+        elif isinstance(memory_ids, str):
+            if memory_ids != record.memory_id:
+                self._by_content[key] = {memory_ids, record.memory_id}
+        else:
+            memory_ids.add(record.memory_id)
+
+    def _unindex_content(self, record: MemoryRecord):
+        key = content_key(record.content)
+        memory_ids = self._by_content.get(key)
+        if memory_ids == record.memory_id:
+            del self._by_content[key]
+        elif isinstance(memory_ids, set):
+            memory_ids.discard(record.memory_id)
+            if len(memory_ids) == 1:
+                self._by_content[key] = next(iter(memory_ids))
+
+    def allocate_id(self) -> str:
+        memory_id = f"mem_{self.next_number:03d}"
+        self.next_number += 1
+        return memory_id
+
+    def upsert(self, memory_id: str, content: str, updated_date: str = None) -> MemoryRecord:
+        record = self._records.get(memory_id)
+        if record is None:
+            record = MemoryRecord(memory_id, updated_date, content)
+            self._records[memory_id] = record
+            number = parse_memory_number(memory_id)
+            if number is not None and number >= self.next_number:
+                self.next_number = number + 1
+        else:
+            # Replaced rather than edited, so snapshot() lists stay unchanged
+            self._unindex_content(record)
+            record = MemoryRecord(memory_id, updated_date, content)
+            self._records[memory_id] = record
+        self._index_content(record)
+        return record
+
+    def remove(self, memory_id: str):
+        record = self._records.pop(memory_id, None)
+        if record is not None:
+            self._unindex_content(record)
+
+    def snapshot(self):
+        """
+        The records in insertion order. Records are never edited in place, so
+        the list stays a consistent view while writes go on, and taking it
+        costs no per-record work.
+        """
+        return list(self._records.values())
+
+    def to_list(self):
+        """Plain dicts in insertion order, the memories.json layout."""
+        return [record.to_dict() for record in self._records.values()]
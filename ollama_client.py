@@ -0,0 +1,274 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import weakref
+import numpy as np
+
+# requests and httpx are imported on first use, like in ollama_wrapper
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+
+
+def backoff_delay(attempt: int, backoff: float) -> float:
+    """Seconds to wait before retry number `attempt` + 1: exponential, with full jitter."""
+    return random.uniform(0, min(backoff * 2 ** attempt, 30.0))
+
+
+def _chat_payload(prompt, model, options, keep_alive, stream):
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": stream,
+        "options": options or {}
+    }
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    return payload
+
+
+class OllamaClient:
+    """
+    Blocking access to the Ollama HTTP API over one pooled requests.Session.
+
+    Connections are kept alive and shared by every thread, so a request
+    skips the TCP handshake once the pool is warm. Each request has a
+    connect and a read timeout, so a stalled server fails the call instead
+    of hanging the thread. 5xx responses and refused or reset connections
+    are retried with jittered exponential backoff; read timeouts are not.
+    """
+
+    def __init__(self, ollama_url: str = DEFAULT_OLLAMA_URL, pool_size: int = 16, timeout: float = 120.0,
+                 connect_timeout: float = 5.0, retries: int = 2, backoff: float = 0.5):
+        """
+        Args:
+            ollama_url: Base URL of the Ollama server.
+            pool_size: Keep-alive connections held open to the server.
+            timeout: Seconds to wait for the next bytes of a response; generation can be slow.
+            connect_timeout: Seconds to wait for a connection.
+            retries: Extra attempts after a 5xx response or a failed connection.
+            backoff: Upper bound in seconds of the first retry delay, doubled per attempt.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.ollama_url = ollama_url.rstrip("/")
+        self.timeout = (connect_timeout, timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._batch_embed_supported = True
+
+    def request(self, method: str, path: str, timeout: float = None, retries: int = None, **kwargs):
+        """
+        Send one request and return the response of the last attempt.
+        `timeout` overrides the read timeout, `retries` the retry count.
+        """
+        import requests
+        retries = self.retries if retries is None else retries
+        timeout = self.timeout if timeout is None else (self.timeout[0], timeout)
+        for attempt in range(retries + 1):
+            try:
+                response = self._session.request(method, self.ollama_url + path, timeout=timeout, **kwargs)
+            except requests.ConnectionError:
+                # Refused, reset or connect timeout; ReadTimeout is not a ConnectionError
+                if attempt == retries:
+                    raise
+            else:
+                if response.status_code < 500 or attempt == retries:
+                    return response
+                response.close()
+            time.sleep(backoff_delay(attempt, self.backoff))
+
+    def embed(self, texts, model: str = "nomic-embed-text") -> np.ndarray:
+        """Embed a batch of texts, one row per text, as returned by the server."""
+        if self._batch_embed_supported:
+            response = self.request("POST", "/api/embed", json={"model": model, "input": list(texts)})
+            if response.status_code != 404:
+                response.raise_for_status()
+                return np.array(response.json()["embeddings"], dtype=np.float32)
+            # Older Ollama servers only provide the single-input endpoint
+            self._batch_embed_supported = False
+
+        vectors = []
+        for text in texts:
+            response = self.request("POST", "/api/embeddings", json={"model": model, "prompt": text})
+            response.raise_for_status()
+            vectors.append(response.json()["embedding"])
+        return np.array(vectors, dtype=np.float32)
+
+    def chat(self, prompt: str, model: str, options: dict = None, keep_alive=None) -> str:
+        """
+        Send the prompt as a single user message and return the reply text.
+        `keep_alive` (e.g. "30m") overrides how long the model stays loaded.
+        """
+        response = self.request("POST", "/api/chat",
+                                json=_chat_payload(prompt, model, options, keep_alive, stream=False))
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+
+    def chat_stream(self, prompt: str, model: str, options: dict = None, keep_alive=None):
+        """
+        Yield the chunks of a streamed reply as Ollama sends them: dicts with
+        message.content, the last one with done=True and eval_count.
+        """
+        response = self.request("POST", "/api/chat", stream=True,
+                                json=_chat_payload(prompt, model, options, keep_alive, stream=True))
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def list_models(self, timeout: float = 5.0):
+        """Names of the models the server has pulled; raises if it cannot be reached."""
+        response = self.request("GET", "/api/tags", timeout=timeout, retries=0)
+        response.raise_for_status()
+        return [model["name"] for model in response.json().get("models", [])]
+
+    def close(self):
+        self._session.close()
+
+
+_shared_sync_clients = {}
+_shared_sync_lock = threading.Lock()
+
+
+def get_client(ollama_url: str = DEFAULT_OLLAMA_URL) -> OllamaClient:
+    """The blocking client shared by every thread for this server."""
+    with _shared_sync_lock:
+        client = _shared_sync_clients.get(ollama_url)
+        if client is None:
+            client = _shared_sync_clients[ollama_url] = OllamaClient(ollama_url)
+        return client
+
+
+def configure_client(ollama_url: str = DEFAULT_OLLAMA_URL, **settings) -> OllamaClient:
+    """
+    Replace the shared blocking client for this server with one built from
+    OllamaClient keyword arguments (pool_size, timeout, retries, ...).
+    """
+    client = OllamaClient(ollama_url, **settings)
+    with _shared_sync_lock:
+        previous = _shared_sync_clients.get(ollama_url)
+        _shared_sync_clients[ollama_url] = client
+    if previous is not None:
+        previous.close()
+    return client
+
+
+class AsyncOllamaClient:
+    """
+    Async access to the Ollama HTTP API over one pooled httpx.AsyncClient.
+
+    Keep-alive connections are reused across calls, so many conversations on
+    one event loop can wait on chat and embedding requests at the same time
+    without a connection setup per request. Timeouts and retries work as in
+    OllamaClient.
+    """
+
+    def __init__(self, ollama_url: str = DEFAULT_OLLAMA_URL, max_connections: int = 100, timeout: float = 120.0,
+                 connect_timeout: float = 5.0, retries: int = 2, backoff: float = 0.5):
+        """
+        Args:
+            ollama_url: Base URL of the Ollama server.
+            max_connections: Upper bound on concurrent connections to the server.
+            timeout: Seconds to wait for the next bytes of a response; generation can be slow.
+            connect_timeout: Seconds to wait for a connection.
+            retries: Extra attempts after a 5xx response or a failed connection.
+            backoff: Upper bound in seconds of the first retry delay, doubled per attempt.
+        """
+        import httpx
+        self.ollama_url = ollama_url
+        self.retries = retries
+        self.backoff = backoff
+        self._client = httpx.AsyncClient(
+            base_url=ollama_url,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        # Refused, reset or connect timeout; read timeouts are not retried
+        self._retryable = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.WriteError,
+                           httpx.RemoteProtocolError)
+        self._batch_embed_supported = True
+
+    async def _send(self, method: str, path: str, payload: dict, stream: bool = False):
+        request = self._client.build_request(method, path, json=payload)
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self._client.send(request, stream=stream)
+            except self._retryable:
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code < 500 or attempt == self.retries:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(backoff_delay(attempt, self.backoff))
+
+    async def embed(self, texts, model: str = "nomic-embed-text") -> np.ndarray:
+        """Embed a batch of texts, one row per text, as returned by the server."""
+        if self._batch_embed_supported:
+            response = await self._send("POST", "/api/embed", {"model": model, "input": list(texts)})
+            if response.status_code != 404:
+                response.raise_for_status()
+                return np.array(response.json()["embeddings"], dtype=np.float32)
+            # Older Ollama servers only provide the single-input endpoint
+            self._batch_embed_supported = False
+
+        async def embed_one(text):
+            response = await self._send("POST", "/api/embeddings", {"model": model, "prompt": text})
+            response.raise_for_status()
+            return response.json()["embedding"]
+
+        return np.array(await asyncio.gather(*(embed_one(text) for text in texts)), dtype=np.float32)
+
+    async def chat(self, prompt: str, model: str, options: dict = None, keep_alive=None) -> str:
+        """
+        Send the prompt as a single user message and return the reply text.
+        `keep_alive` (e.g. "30m") overrides how long the model stays loaded.
+        """
+        response = await self._send("POST", "/api/chat", _chat_payload(prompt, model, options, keep_alive, stream=False))
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+
+    async def chat_stream(self, prompt: str, model: str, options: dict = None, keep_alive=None):
+        """
+        Yield the chunks of a streamed reply as Ollama sends them: dicts with
+        message.content, the last one with done=True and eval_count.
+        """
+        response = await self._send("POST", "/api/chat", _chat_payload(prompt, model, options, keep_alive, stream=True),
+                                    stream=True)
+        try:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            await response.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+# event loop -> {ollama_url: AsyncOllamaClient}; httpx clients cannot move between loops
+_shared_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(ollama_url: str = DEFAULT_OLLAMA_URL) -> AsyncOllamaClient:
+    """The client shared by every caller on the running event loop for this server."""
+    clients = _shared_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(ollama_url)
+    if client is None:
+        client = clients[ollama_url] = AsyncOllamaClient(ollama_url)
+    return client
+
+
+async def aclose_shared_clients():
+    """Close the running loop's shared clients, e.g. on server shutdown."""
+    clients = _shared_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
@@ -1,79 +1,352 @@
-import requests
-from langchain_community.chat_models import ChatOllama
+import time
+from collections import deque
+
+# ollama_client (requests, httpx) and langchain_community are imported on first use;
+# together they dominate start-up time and the REPL does not need them before the first prompt
+
+_ERROR_REPLY = "I'm sorry, I encountered an error while processing your request."
+
+# Ollama options per pipeline phase; OllamaLLM(phase_options=...) overrides them
+# and so do the arguments of a single call. num_ctx is not set per phase:
+# a different context size makes Ollama reload the model.
+GENERATION_PRESETS = {
+    "chat": {"temperature": 0.7, "num_predict": 500},
+    "extraction": {"num_predict": 256},
+    # One JSON decision object
+    "update": {"num_predict": 64},
+    "summary": {"num_predict": 512},
+}
+
+
+class GenerationMetrics:
+    """
+    Timing of one streamed generation. Ollama's eval_count is the token
+    count when the stream reports it; otherwise each chunk counts as one.
+    """
+
+    __slots__ = ("model", "started", "first_token_at", "finished", "tokens")
+
+    def __init__(self, model: str):
+        self.model = model
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished = None
+        self.tokens = 0
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens += 1
+
+    def finish(self, tokens: int = None):
+        self.finished = time.perf_counter()
+        if tokens:
+            self.tokens = tokens
+
+    @property
+    def time_to_first_token(self):
+        """Seconds from the request to the first token, None if none arrived."""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started
+
+    @property
+    def tokens_per_second(self):
+        """Decode speed after the first token."""
+        if self.first_token_at is None or self.finished is None or self.tokens < 2:
+            return None
+        decode_time = self.finished - self.first_token_at
+        return (self.tokens - 1) / decode_time if decode_time > 0 else None
+
+    def to_dict(self):
+        return {
+            "model": self.model,
+            "time_to_first_token": self.time_to_first_token,
+            "tokens": self.tokens,
+            "tokens_per_second": self.tokens_per_second,
+            "total_time": self.finished - self.started if self.finished is not None else None
+        }
+
 
 class OllamaLLM:
-    """LangChain-based wrapper for Ollama to work with the extraction system"""
+    """
+    Wrapper for Ollama to work with the extraction system. Every call goes
+    through the pooled clients of ollama_client, shared by all instances
+    talking to the same server.
+    """
     
-    def __init__(self, model_name="qwen2:7b", temperature=0.3, ollama_url="http://localhost:11434"):
+    def __init__(self, model_name="qwen2:7b", temperature=0.3, ollama_url="http://localhost:11434", embedding_cache=None,
+                 response_cache=None, cache_phases=("extraction", "update", "summary"), phase_options=None,
+                 num_ctx=None, keep_alive="30m"):
+        """
+        Args:
+            temperature: Temperature of the phases whose preset does not set one.
+            response_cache: Optional ResponseCache answering repeated predict() prompts.
+            cache_phases: Pipeline phases whose predict() calls may use the cache.
+                Chat replies go through generate() and are never cached.
+            phase_options: {phase: Ollama options} merged over GENERATION_PRESETS.
+            num_ctx: Context window of every call, or None for the server default.
+            keep_alive: How long Ollama keeps the model loaded after each call.
+        """
         self.model_name = model_name
         self.temperature = temperature
         self.ollama_url = ollama_url
+        self.num_ctx = num_ctx
+        self.keep_alive = keep_alive
+        self.phase_options = {phase: dict(options) for phase, options in GENERATION_PRESETS.items()}
+        for phase, options in (phase_options or {}).items():
+            self.phase_options.setdefault(phase, {}).update(options)
+        # Optional EmbeddingCache shared with the Database
+        self.embedding_cache = embedding_cache
+        self.response_cache = response_cache
+        self.cache_phases = frozenset(cache_phases)
         
-        # Initialize LangChain ChatOllama
-        self.llm = ChatOllama(
-            model=model_name,
-            temperature=temperature,
-            base_url=ollama_url
-        )
+        self._llm = None
+        # GenerationMetrics of recent streamed calls, newest last
+        self.metrics = deque(maxlen=100)
+    
+    @property
+    def llm(self):
+        """
+        LangChain ChatOllama for composing chains, created on first use. The
+        wrapper's own calls do not use it.
+        """
+        if self._llm is None:
+            from langchain_community.chat_models import ChatOllama
+            self._llm = ChatOllama(
+                model=self.model_name,
+                temperature=self.temperature,
+                base_url=self.ollama_url
+            )
+        return self._llm
+    
+    def generation_options(self, phase=None, **overrides):
+        """
+        Ollama options of one call: the instance temperature and num_ctx,
+        then the phase preset, then the overrides that are not None. Returns
+        (options, keep_alive); keep_alive is a request field, not an option.
+        """
+        options = {"temperature": self.temperature}
+        if self.num_ctx is not None:
+            options["num_ctx"] = self.num_ctx
+        options.update(self.phase_options.get(phase, {}))
+        options.update((name, value) for name, value in overrides.items() if value is not None)
+        keep_alive = options.pop("keep_alive", self.keep_alive)
+        return options, keep_alive
+    
+    def predict(self, prompt, phase=None, raise_errors=False, **options):
+        """
+        Compatible with extraction.py expectations. `phase` names the pipeline
+        step ("extraction", "update", "summary") and selects its preset, which
+        `options` override for this call. For phases in cache_phases a
+        response_cache hit skips the generation. A failed call returns an
+        apology as the reply, or raises with raise_errors=True, which memory
+        ingestion uses so the reply is never taken for extracted facts.
+        """
+        options, keep_alive = self.generation_options(phase, **options)
+        key = self._cache_key(prompt, phase, options)
+        response = self.response_cache.get(key) if key is not None else None
+        if response is None:
+            try:
+                response = self._invoke(prompt, options, keep_alive)
+            except Exception as e:
+                if raise_errors:
+                    raise
+                print(f"Error generating response: {e}")
+                return _ERROR_REPLY
+            if key is not None:
+                self.response_cache.put(key, response)
+        return response
+    
+    def _cache_key(self, prompt, phase, options):
+        if self.response_cache is None or phase not in self.cache_phases:
+            return None
+        return self.response_cache.key(self.model_name, options["temperature"], options, phase, prompt)
+    
+    def generate(self, prompt, temperature=None, max_tokens=None, phase="chat", **options):
+        """
+        Generate a response over the shared Ollama client. `max_tokens` is
+        sent as num_predict; `options` are further Ollama options for this
+        call only (num_ctx, stop, keep_alive, top_p, ...).
+        """
+        options, keep_alive = self.generation_options(phase, temperature=temperature, num_predict=max_tokens,
+                                                       **options)
+        try:
+            return self._invoke(prompt, options, keep_alive)
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            return _ERROR_REPLY
+    
+    def _invoke(self, prompt, options, keep_alive):
+        from ollama_client import get_client
+        return get_client(self.ollama_url).chat(prompt, self.model_name, options=options, keep_alive=keep_alive)
     
-    def predict(self, prompt):
-        """Compatible with extraction.py expectations"""
-        return self.generate(prompt)
+    @property
+    def last_metrics(self):
+        """GenerationMetrics of the latest streamed call, or None."""
+        return self.metrics[-1] if self.metrics else None
     
-    def generate(self, prompt, temperature=None, max_tokens=500):
-        """Generate response using LangChain ChatOllama"""
+    def stream(self, prompt, temperature=None, max_tokens=None, phase="chat", **options):
+        """
+        Yield the reply in pieces as Ollama generates them; arguments as in
+        generate(). Time to first token and tokens/sec of the call are
+        appended to self.metrics.
+        """
+        from ollama_client import get_client
+        options, keep_alive = self.generation_options(phase, temperature=temperature, num_predict=max_tokens,
+                                                       **options)
+        metrics = GenerationMetrics(self.model_name)
+        tokens = None
         try:
-            # Use instance temperature if not provided
-            temp = temperature if temperature is not None else self.temperature
-            
-            # Update temperature if different from instance
-            if temp != self.temperature:
-                self.llm.temperature = temp
-            
-            # Generate response
-            response = self.llm.invoke(prompt)
-            
-            # Reset temperature if it was changed
-            if temp != self.temperature:
-                self.llm.temperature = self.temperature
-                
-            return response.content
+            for chunk in get_client(self.ollama_url).chat_stream(
+                prompt, self.model_name, options=options, keep_alive=keep_alive
+            ):
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    metrics.token()
+                    yield content
+                if chunk.get("done"):
+                    tokens = chunk.get("eval_count")
         except Exception as e:
             print(f"Error generating response: {e}")
-            return "I'm sorry, I encountered an error while processing your request."
+            if metrics.first_token_at is None:
+                yield _ERROR_REPLY
+        finally:
+            metrics.finish(tokens)
+            self.metrics.append(metrics)
+    
+    async def astream(self, prompt, temperature=None, max_tokens=None, phase="chat", **options):
+        """Async stream over the shared async Ollama client"""
+        from ollama_client import get_async_client
+        options, keep_alive = self.generation_options(phase, temperature=temperature, num_predict=max_tokens,
+                                                       **options)
+        metrics = GenerationMetrics(self.model_name)
+        tokens = None
+        try:
+            async for chunk in get_async_client(self.ollama_url).chat_stream(
+                prompt, self.model_name, options=options, keep_alive=keep_alive
+            ):
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    metrics.token()
+                    yield content
+                if chunk.get("done"):
+                    tokens = chunk.get("eval_count")
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            if metrics.first_token_at is None:
+                yield _ERROR_REPLY
+        finally:
+            metrics.finish(tokens)
+            self.metrics.append(metrics)
+    
+    async def apredict(self, prompt, phase=None, raise_errors=False, **options):
+        """Async predict"""
+        options, keep_alive = self.generation_options(phase, **options)
+        key = self._cache_key(prompt, phase, options)
+        response = self.response_cache.get(key) if key is not None else None
+        if response is None:
+            try:
+                response = await self._ainvoke(prompt, options, keep_alive)
+            except Exception as e:
+                if raise_errors:
+                    raise
+                print(f"Error generating response: {e}")
+                return _ERROR_REPLY
+            if key is not None:
+                self.response_cache.put(key, response)
+        return response
+    
+    async def agenerate(self, prompt, temperature=None, max_tokens=None, phase="chat", **options):
+        """Generate a response over the shared async Ollama client"""
+        options, keep_alive = self.generation_options(phase, temperature=temperature, num_predict=max_tokens,
+                                                       **options)
+        try:
+            return await self._ainvoke(prompt, options, keep_alive)
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            return _ERROR_REPLY
+    
+    async def _ainvoke(self, prompt, options, keep_alive):
+        from ollama_client import get_async_client
+        return await get_async_client(self.ollama_url).chat(
+            prompt, self.model_name, options=options, keep_alive=keep_alive
+        )
     
     def check_connection(self):
         """Check if Ollama is running and accessible"""
+        from ollama_client import get_client
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            return response.status_code == 200
+            get_client(self.ollama_url).list_models()
+            return True
         except:
             return False
     
     def list_models(self):
         """List available models in Ollama"""
+        from ollama_client import get_client
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            if response.status_code == 200:
-                models = response.json()
-                return [model['name'] for model in models.get('models', [])]
-            return []
+            return get_client(self.ollama_url).list_models()
         except:
             return []
     
-    def embed_text(self, text, model="nomic-embed-text"):
-        """Generate embeddings using Ollama"""
+    def warm_up(self, embedding_model="nomic-embed-text", keep_alive=None):
+        """
+        Load the chat and embedding models into Ollama's memory and keep them
+        loaded for `keep_alive` (default: the instance's), so the first real
+        request skips the model load. Doubles as the connection check;
+        returns True on success.
+        """
+        from ollama_client import get_client
+        client = get_client(self.ollama_url)
+        keep_alive = keep_alive or self.keep_alive
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/embeddings",
-                json={
-                    "model": model,
-                    "prompt": text
-                }
+            # An empty prompt only loads the model
+            response = client.request(
+                "POST", "/api/generate",
+                json={"model": self.model_name, "keep_alive": keep_alive},
+                timeout=300
             )
             response.raise_for_status()
-            embedding_data = response.json()
-            return embedding_data["embedding"]
+            response = client.request(
+                "POST", "/api/embed",
+                json={"model": embedding_model, "input": "warm-up", "keep_alive": keep_alive},
+                timeout=300
+            )
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"⚠️  Warning: Model warm-up failed ({e}). Make sure Ollama is running with 'ollama serve'")
+            return False
+    
+    def embed_text(self, text, model="nomic-embed-text"):
+        """Generate embeddings using Ollama"""
+        if self.embedding_cache is not None:
+            cached = self.embedding_cache.get(model, text)
+            if cached is not None:
+                return cached.tolist()
+        from ollama_client import get_client
+        try:
+            embedding = get_client(self.ollama_url).embed([text], model)[0]
+            if self.embedding_cache is not None:
+                self.embedding_cache.put(model, text, embedding)
+            return embedding.tolist()
+        except Exception as e:
+            print(f"Error generating embedding: {e}")
+            return None
+    
+    async def aembed(self, text, model="nomic-embed-text"):
+        """Generate embeddings over the shared async Ollama client"""
+        if self.embedding_cache is not None:
+            cached = self.embedding_cache.get(model, text)
+            if cached is not None:
+                return cached.tolist()
+        from ollama_client import get_async_client
+        try:
+            embedding = (await get_async_client(self.ollama_url).embed([text], model))[0]
+            if self.embedding_cache is not None:
+                self.embedding_cache.put(model, text, embedding)
+            return embedding.tolist()
         except Exception as e:
             print(f"Error generating embedding: {e}")
             return None
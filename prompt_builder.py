@@ -0,0 +1,191 @@
+import threading
+from collections import OrderedDict
+
+# Shortest piece, in tokens, worth keeping of a line cut to fit a budget
+_MIN_CUT_TOKENS = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for prompt-size metrics."""
+    return (len(text) + 3) // 4
+
+
+class PromptSection:
+    """
+    One named part of a prompt.
+
+    `content` is a string, shortened line by line, or a list of rendered
+    items, which are only ever dropped whole. keep="head" keeps the start
+    of the content (nearest memories, the opening of a summary) and
+    keep="tail" the end (the newest history). Sections with priority None
+    are never shortened. The header and footer are only emitted if some of
+    the content survives.
+    """
+
+    __slots__ = ("name", "content", "priority", "keep", "header", "footer")
+
+    def __init__(self, name: str, content, priority: int = None, keep: str = "head", header: str = "",
+                 footer: str = ""):
+        self.name = name
+        self.content = content or ""
+        self.priority = priority
+        self.keep = keep
+        self.header = header
+        self.footer = footer
+
+
+class BuiltPrompt(str):
+    """
+    The prompt text, plus its size: `sections` maps each section name to
+    its final token count and `truncated` maps the shortened sections to
+    their token count before shortening.
+    """
+
+    @property
+    def tokens(self) -> int:
+        return sum(self.sections.values())
+
+
+class PromptBuilder:
+    """
+    Assembles prompts from PromptSections under token budgets.
+
+    `budgets` maps a prompt kind to {section name: max tokens} plus an
+    optional "total". A section over its budget loses lines or items from
+    the end it does not keep. If the prompt still exceeds its total, the
+    sections with the lowest priority shrink further. Token counts of lines
+    and items, and shortened sections, are cached, so a summary or a
+    history line is counted and cut once rather than on every turn.
+    """
+
+    def __init__(self, budgets: dict = None, count_tokens=estimate_tokens, cache_size: int = 4096,
+                 section_cache_size: int = 256):
+        """
+        Args:
+            budgets: {prompt kind: {section name or "total": tokens}}; missing entries are unlimited.
+            count_tokens: Callable returning the token count of a string,
+                e.g. a real tokenizer for the model in use.
+            cache_size: Token counts of lines and items kept.
+            section_cache_size: Rendered sections kept; each holds its whole content.
+        """
+        self.budgets = budgets or {}
+        self.count_tokens = count_tokens
+        self.cache_size = cache_size
+        self.section_cache_size = section_cache_size
+        self._counts = OrderedDict()
+        self._sections = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, cache, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _remember(self, cache, key, value, limit):
+        with self._lock:
+            cache[key] = value
+            while len(cache) > limit:
+                cache.popitem(last=False)
+
+    def count(self, text: str) -> int:
+        """Token count of `text`, cached."""
+        if not text:
+            return 0
+        tokens = self._cached(self._counts, text)
+        if tokens is None:
+            tokens = self.count_tokens(text)
+            self._remember(self._counts, text, tokens, self.cache_size)
+        return tokens
+
+    def build(self, kind: str, sections) -> BuiltPrompt:
+        """Render the sections of a `kind` prompt within its budgets."""
+        budgets = self.budgets.get(kind, {})
+        rendered = [
+            self._render(section, budgets.get(section.name) if section.priority is not None else None)
+            for section in sections
+        ]
+
+        total = budgets.get("total")
+        if total is not None:
+            overflow = sum(tokens for _, tokens, _ in rendered) - total
+            shrinkable = sorted((i for i, section in enumerate(sections) if section.priority is not None),
+                                key=lambda i: sections[i].priority)
+            for i in shrinkable:
+                if overflow <= 0:
+                    break
+                tokens = rendered[i][1]
+                if tokens:
+                    rendered[i] = self._render(sections[i], max(0, tokens - overflow))
+                    overflow -= tokens - rendered[i][1]
+
+        prompt = BuiltPrompt("".join(text for text, _, _ in rendered))
+        prompt.sections = {}
+        prompt.truncated = {}
+        for section, (_, tokens, full) in zip(sections, rendered):
+            prompt.sections[section.name] = prompt.sections.get(section.name, 0) + tokens
+            if tokens < full:
+                prompt.truncated[section.name] = prompt.truncated.get(section.name, 0) + full
+        return prompt
+
+    def _render(self, section: PromptSection, budget):
+        """(text, tokens, tokens before shortening) of a section cut to `budget`."""
+        content = section.content
+        key = (section.name, section.keep, section.header, section.footer,
+               content if isinstance(content, str) else tuple(content), budget)
+        cached = self._cached(self._sections, key)
+        if cached is not None:
+            return cached
+
+        items = content.splitlines(keepends=True) if isinstance(content, str) else list(content)
+        counts = [self.count(item) for item in items]
+        frame = self.count(section.header) + self.count(section.footer)
+        full = frame + sum(counts) if items else 0
+
+        if budget is None or full <= budget:
+            result = (section.header + "".join(items) + section.footer if items else "", full, full)
+        else:
+            room = budget - frame
+            kept = []
+            ordered = zip(items, counts) if section.keep == "head" else zip(reversed(items), reversed(counts))
+            for item, tokens in ordered:
+                if tokens <= room:
+                    kept.append(item)
+                    room -= tokens
+                    continue
+                # Cut the line crossing the budget; list items are dropped whole
+                if isinstance(content, str) and room >= _MIN_CUT_TOKENS:
+                    piece = self._cut(item, room, section.keep)
+                    if piece:
+                        kept.append(piece)
+                break
+            if section.keep != "head":
+                kept.reverse()
+            if kept:
+                result = (section.header + "".join(kept) + section.footer,
+                          frame + sum(self.count(item) for item in kept), full)
+            else:
+                result = ("", 0, full)
+
+        self._remember(self._sections, key, result, self.section_cache_size)
+        return result
+
+    def _cut(self, line: str, room: int, keep: str) -> str:
+        """The longest part of `line`, marked with "...", that fits in `room` tokens."""
+        newline = "\n" if line.endswith("\n") else ""
+        body = line[:-1] if newline else line
+
+        def piece(length):
+            if keep == "head":
+                return body[:length] + "..." + newline
+            return "..." + body[len(body) - length:] + newline
+
+        low, high = 0, len(body)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(piece(middle)) <= room:
+                low = middle
+            else:
+                high = middle - 1
+        return piece(low) if low else ""
@@ -1,9 +1,41 @@
 from ast import List
 from typing import Dict
+from prompt_builder import PromptBuilder, PromptSection, estimate_tokens
+
+# Token budgets per prompt kind: per section, and "total" for the whole
+# prompt. Sections over budget keep their most useful end (the newest
+# history, the nearest memories); see PromptBuilder.
+PROMPT_BUDGETS = {
+    "chat": {"total": 3072, "memory_context": 512, "recent_context": 1024},
+    "extraction": {"total": 3072, "summary": 512, "recent_messages": 768},
+    "update": {"total": 2560, "similar_memories": 1024},
+    "batch_update": {"total": 3584, "similar_memories": 1536},
+    "summary": {"total": 3072, "memories": 2048},
+}
+
+_builder = PromptBuilder(PROMPT_BUDGETS)
+
+
+def configure_prompt_builder(count_tokens=None, budgets=None) -> PromptBuilder:
+    """
+    Replace the builder behind the prompt functions, e.g. to count with the
+    model's own tokenizer: configure_prompt_builder(count_tokens=lambda
+    text: len(tokenizer.encode(text))). `budgets` are merged over PROMPT_BUDGETS.
+    """
+    global _builder
+    merged = {kind: dict(limits) for kind, limits in PROMPT_BUDGETS.items()}
+    for kind, limits in (budgets or {}).items():
+        merged.setdefault(kind, {}).update(limits)
+    _builder = PromptBuilder(merged, count_tokens or estimate_tokens)
+    return _builder
 
 
 def create_chat_prompt( user_message: str, memory_context: str, recent_context: str) -> str:
-    full_prompt = """You are a helpful, friendly AI assistant with memory capabilities. You can remember information from previous conversations and use it to provide more personalized and contextual responses.
+    """
+    The reply prompt. Returns a BuiltPrompt: a str whose .sections and
+    .truncated report the token count of each part.
+    """
+    instructions = """You are a helpful, friendly AI assistant with memory capabilities. You can remember information from previous conversations and use it to provide more personalized and contextual responses.
 
     When responding:
     - Be natural and conversational
@@ -12,56 +44,50 @@ def create_chat_prompt( user_message: str, memory_context: str, recent_context:
 
     """
 
-    if memory_context:
-        full_prompt += f"The memory context is just the past summary of user information\n{memory_context}\n"
-
-    if recent_context:
-        full_prompt += f"The recent context is just the last few user messages \n{recent_context}\n"
-            
-    full_prompt += "Note: This the summary and recent conversation is just the information use it only when required.\n"
-    full_prompt += "Now, respond to the user's message:\n"
-
-    full_prompt += f"\nUser: {user_message}\nAssistant:"
-
-    return full_prompt
-
-def form_extraction_prompt(summary, recent_messages, mt_1, mt):
+    return _builder.build("chat", [
+        PromptSection("instructions", instructions),
+        PromptSection("memory_context", memory_context, priority=1, keep="head",
+                      header="The memory context is just the past summary of user information\n", footer="\n"),
+        PromptSection("recent_context", recent_context, priority=2, keep="tail",
+                      header="The recent context is just the last few user messages \n", footer="\n"),
+        PromptSection("instructions",
+                      "Note: This the summary and recent conversation is just the information use it only when required.\n"
+                      "Now, respond to the user's message:\n"),
+        PromptSection("user_message", f"\nUser: {user_message}\nAssistant:"),
+    ])
+
+def form_extraction_prompt(summary, recent_messages, mt_1, mt, earlier_turns=()):
     """
     Forms the prompt for the LLM, directing it to extract new, salient,
     factual information exclusively from the LATEST message exchange,
     rephrase them concisely, and return <none> if no such information exists.
+    `earlier_turns` are (user, assistant) pairs not yet extracted, placed
+    before the latest exchange in the primary source.
     """
-    prompt = (
+    intro = (
         "You are an AI assistant designed to extract **CRUCIAL, NEW, ACTIONABLE FACTS** from conversations for memory storage.\n"
         "Your goal is to identify and extract *only* facts that are essential to remember for future interactions, focusing on user-specific details, preferences, instructions, or significant updates.\n"
         "**Your primary directive is to be precise and useful, capturing important details while avoiding noise.**\n\n"
     )
 
     # Place the core data directly with the strictest instructions
-    prompt += "### Primary Source for Facts (Analyze ONLY This Section for Extraction):\n"
-    prompt += f"User: {mt_1}\nAssistant: {mt}\n\n"
-    prompt += "### End Primary Source\n\n"
-
-
-    # Provide context, but with clear boundaries
-    prompt += "### Contextual Information (For Background ONLY - DO NOT Extract Facts From Here):\n"
-    prompt += "--- General Conversation Summary (Provides historical context; DO NOT EXTRACT FACTS):\n"
-    prompt += f"{summary}\n\n"
-    prompt += "--- Recent Conversation History (Provides immediate context; DO NOT EXTRACT FACTS):\n"
-    if not recent_messages:
-        prompt += "No recent messages.\n"
-    else:
-        for msg in recent_messages:
-            if 'content' in msg and 'role' in msg:
-                prompt += f"- {msg['role'].capitalize()}: {msg['content']}\n"
-            elif 'user' in msg and 'assistant' in msg:
-                prompt += f"- User: {msg['user']}\n- Assistant: {msg['assistant']}\n"
-            elif 'content' in msg:
-                prompt += f"- {msg['content']}\n"
-    prompt += "### End Contextual Information\n\n"
+    primary_source = ""
+    for earlier_user, earlier_assistant in earlier_turns:
+        primary_source += f"User: {earlier_user}\nAssistant: {earlier_assistant}\n\n"
+    primary_source += f"User: {mt_1}\nAssistant: {mt}\n\n"
+
+    # Context is shortened first when the prompt is over budget; one item per message
+    history = []
+    for msg in recent_messages or ():
+        if 'content' in msg and 'role' in msg:
+            history.append(f"- {msg['role'].capitalize()}: {msg['content']}\n")
+        elif 'user' in msg and 'assistant' in msg:
+            history.append(f"- User: {msg['user']}\n- Assistant: {msg['assistant']}\n")
+        elif 'content' in msg:
+            history.append(f"- {msg['content']}\n")
 
     # Final, balanced task instructions
-    prompt += (
+    task = (
         "## Task: Extract CRUCIAL, NEW, ACTIONABLE Facts\n"
         "1.  Your sole focus is to analyze **EXCLUSIVELY** the 'Primary Source for Facts' section (the latest User-Assistant exchange) to identify new facts.\n"
         "2.  **DO NOT** extract any facts or information from the 'Contextual Information' sections (Summary or Recent Conversation History). These are for understanding the ongoing conversation, not for new fact extraction.\n"
@@ -86,34 +112,44 @@ def form_extraction_prompt(summary, recent_messages, mt_1, mt):
         "Extracted Facts (or <none>):\n"
     )
 
-    return prompt
+    return _builder.build("extraction", [
+        PromptSection("instructions",
+                      intro + "### Primary Source for Facts (Analyze ONLY This Section for Extraction):\n"),
+        PromptSection("primary_source", primary_source),
+        # Provide context, but with clear boundaries
+        PromptSection("instructions",
+                      "### End Primary Source\n\n"
+                      "### Contextual Information (For Background ONLY - DO NOT Extract Facts From Here):\n"
+                      "--- General Conversation Summary (Provides historical context; DO NOT EXTRACT FACTS):\n"),
+        PromptSection("summary", f"{summary}\n\n", priority=1, keep="head"),
+        PromptSection("instructions",
+                      "--- Recent Conversation History (Provides immediate context; DO NOT EXTRACT FACTS):\n"),
+        PromptSection("recent_messages", history or ["No recent messages.\n"], priority=2, keep="tail"),
+        PromptSection("instructions", "### End Contextual Information\n\n" + task),
+    ])
 
 
-def create_update_prompt(candidate_fact: str, similar_memories) -> str:
-    print("similar_memories:")
-    print(similar_memories)
-    prompt = f"""You are an intelligent memory management system designed to process new information into a knowledge base. Your task is to analyze a 'Candidate Fact' and compare it meticulously with a list of 'Existing Similar Memories' to determine the precise operation required.
+def format_similar_memory(memory) -> str:
+    """Render one neighbour the way create_update_prompt lists it."""
+    return f"Memory ID: {memory.get('memory_id', 'N/A')}\n" \
+           f"Content: {memory.get('content', '')}\n" \
+           f"Similarity Score: {memory.get('score', 0):.3f}\n" \
+           f"---\n" # Separator for clarity between memories
 
-**Your Guiding Principle:** Be extremely selective. **Avoid adding redundant information.** Only add if the 'Candidate Fact' introduces a truly unique and previously unrecorded piece of information. Prioritize updating existing memories if the candidate fact refines or replaces them, even with slight wording differences.
 
----
-## Candidate Fact to Evaluate
-**Candidate Fact:** {candidate_fact}
+def _similar_memory_items(similar_memories):
+    if not similar_memories:
+        return ["No similar memories found. This is highly likely a new fact. Proceed with ADD.\n---\n"] # Strengthen "new fact"
+    return [format_similar_memory(memory) for memory in similar_memories]
 
----
-## Existing Similar Memories (for comparison)
-"""
 
-    if similar_memories:
-        for i, memory in enumerate(similar_memories, 1):
-            prompt += f"Memory ID: {memory.get('memory_id', 'N/A')}\n" \
-                      f"Content: {memory.get('content', '')}\n" \
-                      f"Similarity Score: {memory.get('score', 0):.3f}\n" \
-                      f"---\n" # Separator for clarity between memories
-    else:
-        prompt += "No similar memories found. This is highly likely a new fact. Proceed with ADD.\n---\n" # Strengthen "new fact"
+def format_similar_memories(similar_memories) -> str:
+    """The 'Existing Similar Memories' section of the update prompt."""
+    return "".join(_similar_memory_items(similar_memories))
+
 
-    prompt += """
+# Operation definitions shared by the single-fact and batch update prompts
+_OPERATION_DEFINITIONS = """
 ---
 ## Defined Operations
 
@@ -140,7 +176,21 @@ def create_update_prompt(candidate_fact: str, similar_memories) -> str:
     * **Example 2:** Existing: "User lives in Berlin." Candidate: "The user's residence is Berlin." -> NOOP. (Same fact, different phrasing, no new info).
     * **Output for NOOP:** {"operation": "NOOP", "target_memory_id": "", "updated_content": null}
 
+"""
+
+
+def create_update_prompt(candidate_fact: str, similar_memories) -> str:
+    print("similar_memories:")
+    print(similar_memories)
+    intro = """You are an intelligent memory management system designed to process new information into a knowledge base. Your task is to analyze a 'Candidate Fact' and compare it meticulously with a list of 'Existing Similar Memories' to determine the precise operation required.
+
+**Your Guiding Principle:** Be extremely selective. **Avoid adding redundant information.** Only add if the 'Candidate Fact' introduces a truly unique and previously unrecorded piece of information. Prioritize updating existing memories if the candidate fact refines or replaces them, even with slight wording differences.
+
 ---
+## Candidate Fact to Evaluate
+**Candidate Fact:** """
+
+    instructions = """---
 ## Instructions for Decision Making
 
 1.  **Prioritize Operations (in order): NOOP > DELETE > UPDATE > ADD.** If a 'Candidate Fact' fits the criteria for NOOP, choose NOOP. If not, check DELETE. If not, check UPDATE. Only if none of the above apply, choose ADD.
@@ -153,7 +203,55 @@ def create_update_prompt(candidate_fact: str, similar_memories) -> str:
 Extracted JSON operation:
 """
 
-    return prompt
+    return _builder.build("update", [
+        PromptSection("instructions", intro),
+        PromptSection("candidate_fact", candidate_fact),
+        PromptSection("instructions", "\n\n---\n## Existing Similar Memories (for comparison)\n"),
+        PromptSection("similar_memories", _similar_memory_items(similar_memories), priority=1, keep="head"),
+        PromptSection("instructions", _OPERATION_DEFINITIONS + instructions),
+    ])
+
+
+def create_batch_update_prompt(candidate_facts, similar_memories, related_ids) -> str:
+    """
+    Update prompt deciding all of a turn's candidate facts in one generation.
+    Facts are numbered from 1; `similar_memories` is the union of their
+    neighbours and related_ids[i] the memory_ids found near fact i.
+    """
+    intro = """You are an intelligent memory management system designed to process new information into a knowledge base. Your task is to analyze each numbered 'Candidate Fact' and compare it meticulously with the 'Existing Similar Memories' to determine the precise operation required for it.
+
+**Your Guiding Principle:** Be extremely selective. **Avoid adding redundant information.** Only add if a 'Candidate Fact' introduces a truly unique and previously unrecorded piece of information. Prioritize updating existing memories if a candidate fact refines or replaces them, even with slight wording differences.
+
+---
+## Candidate Facts to Evaluate
+"""
+    facts = ""
+    for number, (candidate_fact, memory_ids) in enumerate(zip(candidate_facts, related_ids), 1):
+        related = ", ".join(memory_ids) if memory_ids else "none"
+        facts += f"{number}. {candidate_fact} (closest existing memories: {related})\n"
+
+    instructions = """---
+## Instructions for Decision Making
+
+1.  **Decide every Candidate Fact separately**, applying the definitions above with the priority **NOOP > DELETE > UPDATE > ADD**.
+2.  **Facts repeating each other:** If two candidate facts state the same thing, decide the first one and mark the later one NOOP.
+3.  **One operation per memory:** Never target the same `target_memory_id` from two facts. If several facts refine the same memory, combine them into one UPDATE and mark the others NOOP.
+4.  **Combine and Condense for UPDATE:** The `updated_content` must combine the candidate fact and the target memory as concisely as possible.
+5.  **Output Format Adherence:** Provide your response **ONLY as a JSON array** with one object per candidate fact, in order, each with the fact number:
+    [{"fact": 1, "operation": "ADD", "target_memory_id": "", "updated_content": null}, {"fact": 2, "operation": "UPDATE", "target_memory_id": "ID_OF_MEMORY_TO_UPDATE", "updated_content": "Revised combined and concise content"}]
+    Do not include any other text, explanations, or conversational fillers outside the JSON.
+
+---
+Extracted JSON operations:
+"""
+
+    return _builder.build("batch_update", [
+        PromptSection("instructions", intro),
+        PromptSection("candidate_facts", facts),
+        PromptSection("instructions", "\n---\n## Existing Similar Memories (for comparison)\n"),
+        PromptSection("similar_memories", _similar_memory_items(similar_memories), priority=1, keep="head"),
+        PromptSection("instructions", _OPERATION_DEFINITIONS + instructions),
+    ])
 
 
 def create_summary_prompt(memories_list):
@@ -161,12 +259,11 @@ def create_summary_prompt(memories_list):
     memories_section = "You are a summary writer focused on extreme brevity and key facts.\n"
     memories_section += "Extract only critical, actionable information from the following memories:\n"
     memories_section += "\n--- Memories Start ---\n"
-    for memory in memories_list:
-        memories_section += f"- {memory['content'].strip()}\n" # Added hyphen for bullet, strip for clean lines
-    memories_section += "--- Memories End ---\n\n"
+    # Over budget, the newest memories are kept
+    memories = [f"- {memory['content'].strip()}\n" for memory in memories_list] # Added hyphen for bullet, strip for clean lines
 
-    prompt = (
-        f"{memories_section}"
+    rules = (
+        "--- Memories End ---\n\n"
         "Rules for Summary:\n"
         "1. **Crucial Facts Only:** Include only facts that absolutely *must* be remembered for future interactions (e.g., user preferences, explicit instructions, names, important decisions).\n"
         "2. **Minimalist:** Eliminate all filler words, greetings, small talk, and conversational flow. Get straight to the point.\n"
@@ -177,4 +274,8 @@ def create_summary_prompt(memories_list):
         "Generate the extremely concise summary based on these rules. If no crucial facts exist, output 'No key info yet.'\n"
         "Summary:"
     )
-    return prompt
\ No newline at end of file
+    return _builder.build("summary", [
+        PromptSection("instructions", memories_section),
+        PromptSection("memories", memories, priority=1, keep="tail"),
+        PromptSection("instructions", rules),
+    ])
\ No newline at end of file
@@ -0,0 +1,93 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """
+    Many concurrent readers or a single writer.
+
+    Writers are preferred: once one is waiting, new readers queue behind it,
+    so a steady stream of searches cannot starve writes. Not reentrant; a
+    thread must not take the read lock again while holding it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class KeyedLock:
+    """
+    One mutex per key, created on first use and dropped once no thread
+    holds or waits for it, so locking by memory_id costs no memory for
+    memories nobody is writing.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        # key -> [lock, holders and waiters]
+        self._locks = {}
+
+    @contextmanager
+    def hold(self, key):
+        """Hold the lock for key; an empty key locks nothing."""
+        if not key:
+            yield
+            return
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
@@ -0,0 +1,227 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from database import Database
+from embedding_cache import EmbeddingCache
+
+_SAFE_USER_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def shard_directory_name(user_id: str) -> str:
+    """Directory name for a user's shard; ids that are not filename-safe are hashed."""
+    if _SAFE_USER_ID.match(user_id):
+        return user_id
+    return "h_" + hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+
+
+class ShardManager:
+    """
+    Per-user memory shards, each a Database with its own metadata, journal
+    and vector index under <root>/<user>/.
+
+    At most max_open shards are kept loaded. Opening one more checkpoints and
+    closes the least recently used idle one, so searches only ever scan the
+    memories of the user they are made for. A shard is idle while nothing
+    holds a lease() on it; if every shard is leased, more than max_open stay
+    open until leases are returned. Shards load and close outside the
+    manager's lock, so one cold user does not hold up lookups for the
+    others. All shards share one embedding cache.
+    """
+
+    def __init__(self, root: str = "./shards", max_open: int = 64, embedding_cache: EmbeddingCache = None,
+                 background_load: bool = False, **database_kwargs):
+        """
+        Args:
+            root: Directory holding one subdirectory per user.
+            max_open: Number of idle shards kept loaded at once.
+            embedding_cache: Cache shared by all shards; defaults to <root>/embedding_cache.sqlite.
+            background_load: Return shards before their vector index is loaded; searches wait for it.
+            database_kwargs: Extra Database arguments applied to every shard (index_type, checkpoint_every, ...).
+        """
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.max_open = max_open
+        self.embedding_cache = embedding_cache if embedding_cache is not None else \
+            EmbeddingCache(os.path.join(root, "embedding_cache.sqlite"))
+        self.background_load = background_load
+        self.database_kwargs = database_kwargs
+        self._shards = OrderedDict()
+        # user_id -> number of leases held on the open shard
+        self._leases = {}
+        # user_id -> Event set once the shard has finished loading or closing
+        self._busy = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id):
+        return user_id in self._shards
+
+    def __len__(self):
+        return len(self._shards)
+
+    def get(self, user_id: str) -> Database:
+        """
+        Return the user's shard, loading it if needed. The shard may be
+        evicted once this returns; use lease() to keep it open while using it.
+        """
+        database = self._acquire(user_id)
+        self._release(user_id)
+        return database
+
+    @contextmanager
+    def lease(self, user_id: str):
+        """Yield the user's shard, which is not evicted before the block exits."""
+        database = self._acquire(user_id)
+        try:
+            yield database
+        finally:
+            self._release(user_id)
+
+    @asynccontextmanager
+    async def alease(self, user_id: str):
+        """
+        Async lease(): loading a cold shard, and closing shards evicted to
+        make room, run in a worker thread instead of on the event loop.
+        """
+        import asyncio
+        database = await asyncio.to_thread(self._acquire, user_id)
+        try:
+            yield database
+        finally:
+            await asyncio.to_thread(self._release, user_id)
+
+    def _acquire(self, user_id):
+        while True:
+            with self._lock:
+                database = self._shards.get(user_id)
+                if database is not None:
+                    self._shards.move_to_end(user_id)
+                    self._leases[user_id] = self._leases.get(user_id, 0) + 1
+                    return database
+                busy = self._busy.get(user_id)
+                if busy is None:
+                    busy = self._busy[user_id] = threading.Event()
+                    break
+            # Loading for another caller, or still being checkpointed after eviction
+            busy.wait()
+
+        try:
+            directory = os.path.join(self.root, shard_directory_name(user_id))
+            database = Database.in_directory(directory, embedding_cache=self.embedding_cache, **self.database_kwargs)
+            if self.background_load:
+                database.start_background_load()
+            else:
+                database.create_vector_database()
+        except BaseException:
+            with self._lock:
+                del self._busy[user_id]
+            busy.set()
+            raise
+        with self._lock:
+            self._shards[user_id] = database
+            self._leases[user_id] = 1
+            del self._busy[user_id]
+            evicted = self._evict_idle()
+        busy.set()
+        self._close(evicted)
+        return database
+
+    def _release(self, user_id):
+        with self._lock:
+            count = self._leases.pop(user_id, 0) - 1
+            if count > 0:
+                self._leases[user_id] = count
+            evicted = self._evict_idle()
+        self._close(evicted)
+
+    def _evict_idle(self):
+        # Caller holds _lock. Shards are marked busy until closed, so they are not reopened meanwhile.
+        evicted = []
+        if len(self._shards) <= self.max_open:
+            return evicted
+        idle = [user_id for user_id in self._shards if user_id not in self._leases]
+        for user_id in idle[:max(0, len(self._shards) - self.max_open)]:
+            evicted.append((user_id, self._shards.pop(user_id)))
+            self._busy[user_id] = threading.Event()
+        return evicted
+
+    def _close(self, evicted):
+        for user_id, database in evicted:
+            print(f"💾 Evicting memory shard for {user_id}")
+            try:
+                database.close()
+            finally:
+                with self._lock:
+                    busy = self._busy.pop(user_id)
+                busy.set()
+
+    def evict(self, user_id: str) -> bool:
+        """Checkpoint and unload one shard if it is open and not leased; returns whether it was."""
+        with self._lock:
+            if user_id not in self._shards or user_id in self._leases:
+                return False
+            evicted = [(user_id, self._shards.pop(user_id))]
+            self._busy[user_id] = threading.Event()
+        self._close(evicted)
+        return True
+
+    def flush(self):
+        """Checkpoint every open shard without unloading it."""
+        with self._lock:
+            shards = list(self._shards.items())
+            for user_id, _ in shards:
+                self._leases[user_id] = self._leases.get(user_id, 0) + 1
+        try:
+            for _, database in shards:
+                database.checkpoint()
+        finally:
+            for user_id, _ in shards:
+                self._release(user_id)
+
+    def close(self):
+        """Checkpoint and unload every shard."""
+        with self._lock:
+            databases = list(self._shards.values())
+            self._shards.clear()
+            self._leases.clear()
+        for database in databases:
+            database.close()
+        self.embedding_cache.close()
+
+
+def resolve_database(database, user_id: str = None) -> Database:
+    """The shard for user_id when given a ShardManager, otherwise the database itself."""
+    if isinstance(database, ShardManager):
+        if user_id is None:
+            raise ValueError("user_id is required when using a ShardManager")
+        return database.get(user_id)
+    return database
+
+
+@contextmanager
+def lease_database(database, user_id: str = None):
+    """
+    Like resolve_database, but a shard stays open until the block exits, so
+    a Database used for several calls is not closed by eviction in between.
+    """
+    if isinstance(database, ShardManager):
+        if user_id is None:
+            raise ValueError("user_id is required when using a ShardManager")
+        with database.lease(user_id) as shard:
+            yield shard
+    else:
+        yield database
+
+
+@asynccontextmanager
+async def alease_database(database, user_id: str = None):
+    """Async lease_database; a cold shard is loaded without blocking the event loop."""
+    if isinstance(database, ShardManager):
+        if user_id is None:
+            raise ValueError("user_id is required when using a ShardManager")
+        async with database.alease(user_id) as shard:
+            yield shard
+    else:
+        yield database
@@ -1,8 +1,16 @@
 import json
 import re
-from typing import List, Dict, Tuple
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 from enum import Enum
-from prompts import create_update_prompt
+from prompts import create_batch_update_prompt, create_update_prompt, estimate_tokens, format_similar_memories
+from database import RetrievalPolicy
+from shards import alease_database, lease_database, resolve_database
+
+# Output budget of one decision object; a batch call gets one per fact
+DECISION_TOKENS = 64
+
 class MemoryOperation(Enum):
     ADD = "ADD"
     UPDATE = "UPDATE"
@@ -18,24 +26,124 @@ class UpdatePhase:
     LLM-based reasoning and semantic similarity matching.
     """
     
-    def __init__(self, llm, database, top_k_similar: int = 5):
+    def __init__(self, llm, database, top_k_similar: int = 5, retrieval_policy: RetrievalPolicy = None,
+                 user_id: str = None, noop_distance: float = 0.02, add_distance: float = 1.0,
+                 batch_decisions: bool = False, max_parallel: int = 1):
         """
         Args:
             llm: LLM instance for decision making (with tool/function calling capability)
-            database: Database interface for memory CRUD operations
-            top_k_similar: Number of similar memories to retrieve for comparison
+            database: Database interface for memory CRUD operations, or a ShardManager
+            top_k_similar: Maximum number of similar memories to retrieve for comparison
+            retrieval_policy: Prunes distant or weak neighbours before they reach the prompt.
+                Defaults to top_k_similar hits within distance 1.0 and 15% of the best score.
+            user_id: Selects the user's shard when `database` is a ShardManager.
+            noop_distance: A neighbour at most this far away (squared L2 on
+                normalized embeddings) makes the fact a NOOP without asking the LLM.
+            add_distance: With no neighbour within this distance the fact is
+                ADDed without asking the LLM. None disables either shortcut.
+            batch_decisions: Decide all of a turn's facts that need the LLM
+                with one generation instead of one per fact.
+            max_parallel: Number of per-fact LLM decisions run at once. Above 1,
+                decisions are made concurrently and applied in fact order, each
+                re-checked against the writes made before it.
         """
         self.llm = llm
-        self.database = database
+        self._database = database
+        self.user_id = user_id
         self.top_k_similar = top_k_similar
+        self.retrieval_policy = retrieval_policy or RetrievalPolicy(
+            max_k=top_k_similar, max_distance=1.0, relative_gap=0.15
+        )
+        self.noop_distance = noop_distance
+        self.add_distance = add_distance
+        self.batch_decisions = batch_decisions
+        self.max_parallel = max_parallel
+        # memory_id -> content (None once deleted) written earlier in the current turn
+        self._written = None
+        self.stats = {
+            "retrievals": 0,
+            "neighbours_kept": 0,
+            "neighbours_pruned": 0,
+            "prompt_tokens_saved": 0,
+            "llm_decisions": 0,
+            "llm_calls_avoided": 0,
+            "fast_noop_exact": 0,
+            "fast_noop_near": 0,
+            "fast_add": 0,
+            "batch_calls": 0,
+            "batch_decided": 0,
+            "batch_conflicts": 0,
+            "batch_fallbacks": 0,
+            "parallel_rechecks": 0
+        }
+    
+    @property
+    def database(self):
+        """The Database this phase writes to, resolved per call so evicted shards are reopened."""
+        return resolve_database(self._database, self.user_id)
+    
+    def lease(self):
+        """Context manager keeping this phase's shard open, so it is not evicted mid-turn."""
+        return lease_database(self._database, self.user_id)
+    
+    def alease(self):
+        """Async lease(); a cold shard is loaded off the event loop."""
+        return alease_database(self._database, self.user_id)
     
     def retrieve_similar_memories(self, candidate_fact: str) -> List[Dict]:
-        similar_memories = self.database.similarity_search(
+        results = self.database.similarity_search(
             query=candidate_fact,
-            k=self.top_k_similar
+            k=self.retrieval_policy.max_k
         )
+        return self._prune(results)
+    
+    def retrieve_similar_memories_many(self, candidate_facts: List[str]) -> List[List[Dict]]:
+        """Unpruned neighbours for every fact, from one batched search."""
+        return self.database.similarity_search_many(candidate_facts, k=self.retrieval_policy.max_k)
+    
+    async def aretrieve_similar_memories_many(self, candidate_facts: List[str]) -> List[List[Dict]]:
+        return await self.database.asimilarity_search_many(candidate_facts, k=self.retrieval_policy.max_k)
+    
+    def _prune(self, results: List[Dict]) -> List[Dict]:
+        similar_memories, _ = self.retrieval_policy.apply(results)
+        self._record_retrieval(results, similar_memories)
         return similar_memories
     
+    def _refresh_neighbours(self, candidate_fact: str, results: List[Dict]) -> List[Dict]:
+        """
+        Bring neighbours fetched at the start of the turn up to date with the
+        writes made for earlier facts: deleted memories are dropped and added
+        or updated ones are ranked against the fact with their cached embeddings.
+        """
+        if not self._written:
+            return results
+        
+        results = [result for result in results if result['memory_id'] not in self._written]
+        fact_embedding = self.database.embed_text(candidate_fact)
+        for memory_id, content in self._written.items():
+            if content is None:
+                continue
+            distance = np.float32(np.sum((self.database.embed_text(content) - fact_embedding) ** 2))
+            results.append({
+                'memory_id': memory_id,
+                'content': content,
+                'score': 1.0 / (1.0 + distance),
+                'distance': distance
+            })
+        results.sort(key=lambda result: result['distance'])
+        return results[:self.retrieval_policy.max_k]
+    
+    def _record_retrieval(self, results: List[Dict], similar_memories: List[Dict]):
+        """Count pruned neighbours and the update-prompt tokens that saved."""
+        self.stats["retrievals"] += 1
+        self.stats["neighbours_kept"] += len(similar_memories)
+        self.stats["neighbours_pruned"] += len(results) - len(similar_memories)
+        if len(similar_memories) < len(results):
+            self.stats["prompt_tokens_saved"] += (
+                estimate_tokens(format_similar_memories(results))
+                - estimate_tokens(format_similar_memories(similar_memories))
+            )
+    
     
     
     def extract_json_from_response(self, response: str) -> Dict:
@@ -62,11 +170,169 @@ class UpdatePhase:
                 "updated_content": None
             }
     
+    def pre_decide(self, candidate_fact: str, neighbours: List[Dict], count: bool = True) -> Optional[Dict]:
+        """
+        Decide the cases the LLM would only confirm: an exact duplicate
+        (normalized text) or a near-identical neighbour is a NOOP, and a fact
+        with no neighbour within add_distance is an ADD. Returns None when
+        the LLM has to decide. count=False leaves the stats alone, for a fact
+        that is decided again.
+        """
+        shortcut = self._shortcut(candidate_fact, neighbours)
+        if shortcut is None:
+            return None
+        operation, target_memory_id, fast_path = shortcut
+        if count:
+            self.stats[fast_path] += 1
+            self.stats["llm_calls_avoided"] += 1
+        print(f"⚡ Decided without the LLM ({fast_path}): {operation}")
+        return {"operation": operation, "target_memory_id": target_memory_id, "updated_content": None,
+                "fast_path": fast_path}
+    
+    def _shortcut(self, candidate_fact: str, neighbours: List[Dict]) -> Optional[Tuple[str, str, str]]:
+        """(operation, target_memory_id, stats key) of pre_decide, without counting it."""
+        duplicate_id = self.database.find_duplicate(candidate_fact)
+        nearest = min(neighbours, key=lambda result: result['distance'], default=None)
+        if duplicate_id is not None:
+            return "NOOP", duplicate_id, "fast_noop_exact"
+        if self.noop_distance is not None and nearest is not None and nearest['distance'] <= self.noop_distance:
+            return "NOOP", nearest['memory_id'], "fast_noop_near"
+        if self.add_distance is not None and (nearest is None or nearest['distance'] > self.add_distance):
+            return "ADD", "", "fast_add"
+        return None
+    
+    def batch_decide(self, candidate_facts: List[str], neighbour_lists: List[List[Dict]]) -> Dict[int, Dict]:
+        """
+        Decide every fact of the turn that no shortcut settles with one LLM
+        call. Returns {fact index: decision}; facts whose item is missing,
+        invalid or conflicting are left out and get a per-fact call instead.
+        """
+        request = self._batch_request(candidate_facts, neighbour_lists)
+        if request is None:
+            return {}
+        prompt, pending, shown_ids = request
+        response = self.llm.predict(prompt, phase="update", raise_errors=True, num_predict=DECISION_TOKENS * len(pending))
+        return self._parse_batch_decisions(response, pending, shown_ids)
+    
+    async def abatch_decide(self, candidate_facts: List[str], neighbour_lists: List[List[Dict]]) -> Dict[int, Dict]:
+        request = self._batch_request(candidate_facts, neighbour_lists)
+        if request is None:
+            return {}
+        prompt, pending, shown_ids = request
+        response = await self.llm.apredict(prompt, phase="update", raise_errors=True,
+                                           num_predict=DECISION_TOKENS * len(pending))
+        return self._parse_batch_decisions(response, pending, shown_ids)
+    
+    def _batch_request(self, candidate_facts, neighbour_lists):
+        """(prompt, indexes of the facts in it, memory_ids shown), or None if fewer than two facts need the LLM."""
+        pending = []
+        for index, (candidate_fact, neighbours) in enumerate(zip(candidate_facts, neighbour_lists)):
+            if self._shortcut(candidate_fact, neighbours) is None:
+                pending.append((index, self.retrieval_policy.apply(neighbours)[0]))
+        if len(pending) < 2:
+            return None
+        
+        # Union of the neighbours, each memory shown once with its best score
+        shown = {}
+        for _, similar_memories in pending:
+            for memory in similar_memories:
+                if memory['memory_id'] not in shown or memory['score'] > shown[memory['memory_id']]['score']:
+                    shown[memory['memory_id']] = memory
+        prompt = create_batch_update_prompt(
+            [candidate_facts[index] for index, _ in pending],
+            sorted(shown.values(), key=lambda memory: memory['score'], reverse=True),
+            [[memory['memory_id'] for memory in similar_memories] for _, similar_memories in pending]
+        )
+        self.stats["llm_decisions"] += 1
+        self.stats["batch_calls"] += 1
+        return prompt, [index for index, _ in pending], set(shown)
+    
+    def _parse_batch_decisions(self, llm_response: str, pending: List[int], shown_ids) -> Dict[int, Dict]:
+        print(f"LLM Batch Response: {llm_response}")
+        items = self.extract_json_array_from_response(llm_response)
+        
+        decisions = {}
+        for item in items:
+            number = item.get("fact")
+            if not isinstance(number, int) or not 1 <= number <= len(pending) or pending[number - 1] in decisions:
+                continue
+            operation = item.get("operation")
+            target_memory_id = item.get("target_memory_id") or ""
+            if operation not in ("ADD", "UPDATE", "DELETE", "NOOP"):
+                continue
+            if operation in ("UPDATE", "DELETE") and target_memory_id not in shown_ids:
+                continue
+            if operation == "UPDATE" and not item.get("updated_content"):
+                continue
+            decisions[pending[number - 1]] = {
+                "operation": operation,
+                "target_memory_id": target_memory_id,
+                "updated_content": item.get("updated_content"),
+                "batch": True
+            }
+        
+        # Two facts editing the same memory: the first keeps its decision, later
+        # ones are decided again after it has been applied
+        targeted = set()
+        for index in sorted(decisions):
+            decision = decisions[index]
+            if decision["operation"] not in ("UPDATE", "DELETE"):
+                continue
+            if decision["target_memory_id"] in targeted:
+                print(f"⚠️ Batch decisions conflict on {decision['target_memory_id']}, deciding fact {index + 1} separately")
+                del decisions[index]
+                self.stats["batch_conflicts"] += 1
+            else:
+                targeted.add(decision["target_memory_id"])
+        
+        self.stats["batch_decided"] += len(decisions)
+        self.stats["batch_fallbacks"] += len(pending) - len(decisions)
+        return decisions
+    
+    def _batch_decision(self, batch_decisions: Dict[int, Dict], index: int) -> Optional[Dict]:
+        """The batch decision for a fact, unless another decision of this turn already wrote its target."""
+        decision = batch_decisions.get(index)
+        if decision is not None and decision["target_memory_id"] and decision["target_memory_id"] in self._written:
+            print(f"⚠️ {decision['target_memory_id']} changed since the batch decision, deciding fact {index + 1} separately")
+            self.stats["batch_fallbacks"] += 1
+            return None
+        return decision
+    
+    def extract_json_array_from_response(self, response: str) -> List[Dict]:
+        """The objects of the JSON array in an LLM response; salvages well-formed objects from a broken array."""
+        for candidate in (response.strip(), *re.findall(r'\[.*\]', response, re.DOTALL)):
+            try:
+                parsed = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(parsed, list):
+                return [item for item in parsed if isinstance(item, dict)]
+        
+        items = []
+        for match in re.findall(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response, re.DOTALL):
+            try:
+                items.append(json.loads(match))
+            except json.JSONDecodeError:
+                continue
+        if not items:
+            print(f"⚠️ Could not parse JSON array from response: {response}")
+        return items
+    
     def llm_decision_tool_call(self, candidate_fact: str, similar_memories: List[Dict]) -> Dict:
+        self.stats["llm_decisions"] += 1
         prompt = create_update_prompt(candidate_fact, similar_memories)
         
         # Call LLM
-        llm_response = self.llm.predict(prompt)
+        llm_response = self.llm.predict(prompt, phase="update", raise_errors=True)
+        return self._parse_decision(llm_response)
+    
+    async def allm_decision_tool_call(self, candidate_fact: str, similar_memories: List[Dict]) -> Dict:
+        self.stats["llm_decisions"] += 1
+        prompt = create_update_prompt(candidate_fact, similar_memories)
+        llm_response = await self.llm.apredict(prompt, phase="update", raise_errors=True)
+        return self._parse_decision(llm_response)
+    
+    def _parse_decision(self, llm_response: str) -> Dict:
         print(f"LLM Response: {llm_response}")
         
         # Extract and parse JSON
@@ -81,67 +347,242 @@ class UpdatePhase:
         return decision
     
     def execute_operation(self, operation_decision: Dict, candidate_fact: str) -> bool:
-        operation = operation_decision.get("operation")
-        target_memory_id = operation_decision.get("target_memory_id")
-        updated_content = operation_decision.get("updated_content")
+        write = self._plan_write(operation_decision, candidate_fact)
+        if write is None:
+            return False
+        kind, memory_id, content = write
         
         try:
-            if operation == "ADD":
-                self.database.add_memory(candidate_fact)
-                print(f"✅ Added new memory: {candidate_fact[:50]}...")
-            elif operation == "UPDATE":
-                if target_memory_id and updated_content:
-                    self.database.update_memory(target_memory_id, updated_content)
-                    print(f"✅ Updated memory {target_memory_id}")
-                else:
-                    print(f"⚠️ UPDATE operation missing target_memory_id or updated_content, adding as new memory")
-                    self.database.add_memory(candidate_fact)
-            elif operation == "DELETE":
-                if target_memory_id:
-                    self.database.delete_memory(target_memory_id)
-                    print(f"✅ Deleted memory {target_memory_id}")
-                else:
-                    print(f"⚠️ DELETE operation missing target_memory_id")
-                    return False
-            elif operation == "NOOP":
-                print(f"ℹ️ No operation needed for: {candidate_fact[:50]}...")
-            
-            return True if operation in ["ADD", "UPDATE", "DELETE"] else False
-            
+            if kind == "add":
+                memory_id = self.database.add_memory(content)
+            elif kind == "update":
+                self.database.update_memory(memory_id, content)
+            else:
+                self.database.delete_memory(memory_id)
+        except Exception as e:
+            print(f"❌ Error executing {operation_decision.get('operation')} operation: {e}")
+            return False
+        return self._finish_write(kind, memory_id, content)
+    
+    async def aexecute_operation(self, operation_decision: Dict, candidate_fact: str) -> bool:
+        write = self._plan_write(operation_decision, candidate_fact)
+        if write is None:
+            return False
+        kind, memory_id, content = write
+        
+        try:
+            if kind == "add":
+                memory_id = await self.database.aadd_memory(content)
+            elif kind == "update":
+                await self.database.aupdate_memory(memory_id, content)
+            else:
+                await self.database.adelete_memory(memory_id)
         except Exception as e:
-            print(f"❌ Error executing {operation} operation: {e}")
+            print(f"❌ Error executing {operation_decision.get('operation')} operation: {e}")
             return False
+        return self._finish_write(kind, memory_id, content)
+    
+    def _plan_write(self, operation_decision: Dict, candidate_fact: str) -> Optional[Tuple[str, str, str]]:
+        """The write a decision asks for as (kind, memory_id, content), or None if it writes nothing."""
+        operation = operation_decision.get("operation")
+        target_memory_id = operation_decision.get("target_memory_id")
+        updated_content = operation_decision.get("updated_content")
+        
+        if operation == "ADD":
+            return "add", None, candidate_fact
+        if operation == "UPDATE":
+            if target_memory_id and updated_content:
+                return "update", target_memory_id, updated_content
+            print("⚠️ UPDATE operation missing target_memory_id or updated_content, adding as new memory")
+            return "add", None, candidate_fact
+        if operation == "DELETE":
+            if target_memory_id:
+                return "delete", target_memory_id, None
+            print("⚠️ DELETE operation missing target_memory_id")
+            return None
+        if operation == "NOOP":
+            print(f"ℹ️ No operation needed for: {candidate_fact[:50]}...")
+        return None
+    
+    def _finish_write(self, kind: str, memory_id: str, content: str) -> bool:
+        self._record_write(memory_id, content)
+        if kind == "add":
+            print(f"✅ Added new memory: {content[:50]}...")
+        elif kind == "update":
+            print(f"✅ Updated memory {memory_id}")
+        else:
+            print(f"✅ Deleted memory {memory_id}")
+        return True
+    
+    def _record_write(self, memory_id: str, content: str):
+        if self._written is not None:
+            self._written[memory_id] = content
     
     def process_extracted_memories(self, extracted_memories: List[str]) -> List[Dict]:
         """Process a list of extracted memories and determine operations for each"""
+        with self.lease():
+            if self.max_parallel > 1 and len(extracted_memories) > 1:
+                return self._process_parallel(extracted_memories)
+            return self._process_sequential(extracted_memories)
+    
+    def _process_sequential(self, extracted_memories: List[str]) -> List[Dict]:
         results = []
         
-        for candidate_fact in extracted_memories:
-            print(f"\n🔄 Processing candidate fact: {candidate_fact}")
-            print("-" * 50)
-            
-            # Retrieve similar memories
-            similar_memories = self.retrieve_similar_memories(candidate_fact)
-            print(f"Found {len(similar_memories)} similar memories")
-            
-            # Get LLM decision
-            operation_decision = self.llm_decision_tool_call(candidate_fact, similar_memories)
+        # Neighbours for every fact of the turn from one batched embedding call and search
+        neighbour_lists = self.retrieve_similar_memories_many(extracted_memories)
+        batch_decisions = self.batch_decide(extracted_memories, neighbour_lists) if self.batch_decisions else {}
+        self._written = {}
+        
+        for index, (candidate_fact, neighbours) in enumerate(zip(extracted_memories, neighbour_lists)):
+            self._fact_header(candidate_fact)
+            similar_memories, operation_decision = self._prepare_fact(index, candidate_fact, neighbours, batch_decisions)
+            if operation_decision is None:
+                operation_decision = self.llm_decision_tool_call(candidate_fact, similar_memories)
             print(f"LLM Decision: {operation_decision}")
             
             # Execute the operation
             success = self.execute_operation(operation_decision, candidate_fact)
-
-            # Track results
-            result = {
-                "candidate_fact": candidate_fact,
-                "operation_decision": operation_decision,
-                "similar_memories_count": len(similar_memories),
-                "execution_success": success
-            }
-            results.append(result)
+            results.append(self._fact_result(candidate_fact, operation_decision, similar_memories, success))
+        
+        self._written = None
+        return results
+    
+    def _fact_header(self, candidate_fact: str):
+        print(f"\n🔄 Processing candidate fact: {candidate_fact}")
+        print("-" * 50)
+    
+    def _prepare_fact(self, index: int, candidate_fact: str, neighbours: List[Dict], batch_decisions: Dict[int, Dict]):
+        """
+        Refreshed, pruned neighbours of a fact and the decision they (or the
+        batch call) already settle; the decision is None when the LLM must be
+        asked. Earlier writes of this turn can turn a batch decision into a duplicate.
+        """
+        neighbours = self._refresh_neighbours(candidate_fact, neighbours)
+        similar_memories = self._prune(neighbours)
+        print(f"Found {len(similar_memories)} similar memories")
+        return similar_memories, self.pre_decide(candidate_fact, neighbours) or self._batch_decision(batch_decisions, index)
+    
+    def _fact_result(self, candidate_fact: str, operation_decision: Dict, similar_memories: List[Dict], success: bool) -> Dict:
+        print(f"✅ Processed: {candidate_fact[:50]}... -> {operation_decision['operation']}")
+        return {
+            "candidate_fact": candidate_fact,
+            "operation_decision": operation_decision,
+            "similar_memories_count": len(similar_memories),
+            "execution_success": success
+        }
+    
+    def _process_parallel(self, extracted_memories: List[str]) -> List[Dict]:
+        """
+        process_extracted_memories with the LLM decisions of all facts in
+        flight at once. Every decision is made against the turn's starting
+        neighbours, then applied in fact order: if the writes before it (or
+        another session) changed the fact's neighbour set, it is decided
+        again first, so the outcome matches a sequential run.
+        """
+        # Read before searching, so a write that lands during the search still counts as a change
+        version = self.database.write_version
+        neighbour_lists = self.retrieve_similar_memories_many(extracted_memories)
+        batch_decisions = self.batch_decide(extracted_memories, neighbour_lists) if self.batch_decisions else {}
+        results = []
+        
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="update-decision") as pool:
+            decided = []
+            for index, (candidate_fact, neighbours) in enumerate(zip(extracted_memories, neighbour_lists)):
+                similar_memories = self._prune(neighbours)
+                decision = self.pre_decide(candidate_fact, neighbours) or batch_decisions.get(index)
+                if decision is None:
+                    self.stats["llm_decisions"] += 1
+                    decision = pool.submit(
+                        self.llm.predict, create_update_prompt(candidate_fact, similar_memories), phase="update",
+                        raise_errors=True
+                    )
+                decided.append((decision, similar_memories, self._neighbour_state(candidate_fact, neighbours)))
+            
+            self._written = {}
+            for candidate_fact, (decision, similar_memories, state) in zip(extracted_memories, decided):
+                self._fact_header(candidate_fact)
+                if isinstance(decision, Future):
+                    decision = self._parse_decision(decision.result())
+                decision, similar_memories, success = self._settle(
+                    candidate_fact, decision, similar_memories, state, version
+                )
+                print(f"Found {len(similar_memories)} similar memories")
+                print(f"LLM Decision: {decision}")
+                results.append(self._fact_result(candidate_fact, decision, similar_memories, success))
+        
+        self._written = None
+        return results
+    
+    def _settle(self, candidate_fact, decision, similar_memories, state, version):
+        """
+        Execute a decision made in parallel under its target memory's lock.
+        If anything was written since its neighbours were searched at
+        Database write_version `version` (by earlier facts or another
+        session), the search is run again under the lock, and the fact is
+        decided again if what it was decided from changed. Returns (decision,
+        similar_memories, success).
+        """
+        while True:
+            with self.database.memory_locks.hold(decision.get("target_memory_id")):
+                current = state
+                if self.database.write_version != version:
+                    version = self.database.write_version
+                    neighbours = self.retrieve_similar_memories_many([candidate_fact])[0]
+                    current = self._neighbour_state(candidate_fact, neighbours)
+                if current == state:
+                    return decision, similar_memories, self.execute_operation(decision, candidate_fact)
+            self.stats["parallel_rechecks"] += 1
+            print("🔁 Neighbours changed since the decision, deciding again")
+            similar_memories = self._prune(neighbours)
+            decision = self.pre_decide(candidate_fact, neighbours, count=False) or \
+                self.llm_decision_tool_call(candidate_fact, similar_memories)
+            state = current
+    
+    def _neighbour_state(self, candidate_fact: str, neighbours: List[Dict]) -> Tuple:
+        """
+        What a decision was made from: pre_decide's outcome and the ids and
+        current contents of the pruned neighbours the LLM was shown. The
+        decision is stale once this changes; neighbours pruned away do not count.
+        """
+        similar_memories, _ = self.retrieval_policy.apply(neighbours)
+        memories = self.database.memories
+        return self._shortcut(candidate_fact, neighbours), tuple(
+            (result['memory_id'], getattr(memories.get(result['memory_id']), 'content', None))
+            for result in similar_memories
+        )
+    
+    async def aprocess_extracted_memories(self, extracted_memories: List[str]) -> List[Dict]:
+        """
+        Async process_extracted_memories. Facts are still decided one after
+        another, since each decision can depend on the previous fact's write;
+        concurrency comes from running many sessions' UpdatePhases on one loop.
+        """
+        async with self.alease():
+            return await self._aprocess_sequential(extracted_memories)
+    
+    async def _aprocess_sequential(self, extracted_memories: List[str]) -> List[Dict]:
+        results = []
+        
+        neighbour_lists = await self.aretrieve_similar_memories_many(extracted_memories)
+        batch_decisions = await self.abatch_decide(extracted_memories, neighbour_lists) if self.batch_decisions else {}
+        self._written = {}
+        
+        for index, (candidate_fact, neighbours) in enumerate(zip(extracted_memories, neighbour_lists)):
+            self._fact_header(candidate_fact)
+            if self._written:
+                # Warm the cache so the refresh below never blocks the loop on the network
+                await self.database.aembed_texts(
+                    [candidate_fact] + [content for content in self._written.values() if content is not None]
+                )
+            similar_memories, operation_decision = self._prepare_fact(index, candidate_fact, neighbours, batch_decisions)
+            if operation_decision is None:
+                operation_decision = await self.allm_decision_tool_call(candidate_fact, similar_memories)
+            print(f"LLM Decision: {operation_decision}")
             
-            print(f"✅ Processed: {candidate_fact[:50]}... -> {operation_decision['operation']}")
+            success = await self.aexecute_operation(operation_decision, candidate_fact)
+            results.append(self._fact_result(candidate_fact, operation_decision, similar_memories, success))
         
+        self._written = None
         return results
 
 # Example usage:
@@ -178,3 +619,4 @@ if __name__ == "__main__":
         print(f"Operation: {result['operation_decision']['operation']}")
         print(f"Success: {result['execution_success']}")
         print("-" * 30)
+    print(f"Retrieval and decision stats: {update_phase.stats}")
@@ -0,0 +1,427 @@
+import hashlib
+import faiss
+import numpy as np
+
+
+def memory_label(memory_id: str) -> int:
+    """
+    Map a memory_id to the stable int64 label used in the vector index.
+
+    "mem_042" maps to 42. Ids that do not follow the mem_<n> scheme are hashed
+    into a range above any realistic counter value so the two never collide.
+    """
+    prefix, _, number = memory_id.rpartition('_')
+    if prefix == 'mem' and number.isdigit():
+        return int(number)
+    digest = hashlib.sha1(memory_id.encode('utf-8')).digest()
+    return (1 << 60) + int.from_bytes(digest[:7], 'big')
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+
+def build_index(index_type: str, dimension: int, training_vectors=None, nlist: int = None,
+                hnsw_m: int = 32, pq_m: int = None, pq_nbits: int = 8, seed: int = 0):
+    """
+    Create a FAISS index of one of INDEX_TYPES, trained on `training_vectors`
+    when the type needs it.
+
+    nlist defaults to 4*sqrt(n), capped so every centroid gets ~39 training
+    points, and pq_m to d/16 sub-quantizers (48 for 768-d embeddings). IVF
+    indexes get a direct map so compaction can reconstruct them.
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "hnsw":
+        return faiss.IndexHNSWFlat(dimension, hnsw_m)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+    training_vectors = np.ascontiguousarray(training_vectors, dtype=np.float32)
+    n = len(training_vectors)
+    if nlist is None:
+        nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+    quantizer = faiss.IndexFlatL2(dimension)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    else:
+        if pq_m is None:
+            pq_m = next(m for m in (dimension // 16, 64, 32, 16, 8, 4, 2, 1) if m and dimension % m == 0)
+        # Each sub-quantizer needs at least 2**nbits training points
+        pq_nbits = max(1, min(pq_nbits, int(np.log2(max(n, 2)))))
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits)
+
+    sample_size = min(n, nlist * 256)
+    if sample_size < n:
+        sample = np.random.default_rng(seed).choice(n, sample_size, replace=False)
+        training_vectors = training_vectors[np.sort(sample)]
+    index.train(training_vectors)
+    index.make_direct_map()
+    return index
+
+
+def index_type_of(index) -> str:
+    """Name from INDEX_TYPES for a FAISS index instance."""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Apply recall/latency knobs to an IVF (nprobe) or HNSW (efSearch) index."""
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+class IdMappedIndex:
+    """
+    FAISS index addressed by stable integer labels instead of row positions.
+
+    Rows are only ever appended. Removing or replacing a vector tombstones its
+    old row, and tombstoned rows are excluded from every search through an
+    IDSelector bitmap. New rows land in a small flat buffer that is merged into
+    the main index in batches, because FAISS reallocates its storage on every
+    add. Together this keeps a single edit at O(d) whatever the corpus size;
+    compact() reclaims tombstoned rows in one vectorized pass once they make up
+    `compact_ratio` of the index.
+
+    A memory-mapped main index (mapped=True) is only read from until the first
+    merge or compaction, which copies it into memory.
+
+    With auto_maintain=False, add() and remove() never merge or compact
+    themselves and always stay O(d); the owner checks needs_maintenance() and
+    runs maintain() on a copy(), so readers of the current version are never
+    held up by the O(n) work.
+
+    The main index can be any of INDEX_TYPES. Flat indexes compact with
+    remove_ids; IVF and HNSW indexes, which cannot drop rows in place, are
+    rebuilt from their reconstructed live vectors.
+    """
+
+    def __init__(self, dimension: int = 768, index=None, row_labels=None, row_keys=None, mapped: bool = False,
+                 compact_ratio: float = 0.25, merge_ratio: float = 0.05, min_merge_size: int = 1024,
+                 auto_maintain: bool = True):
+        self.dimension = dimension
+        self.index = index if index is not None else faiss.IndexFlatL2(dimension)
+        self.mapped = mapped
+        self.compact_ratio = compact_ratio
+        self.merge_ratio = merge_ratio
+        self.min_merge_size = min_merge_size
+        self.auto_maintain = auto_maintain
+        self._buffer = faiss.IndexFlatL2(dimension)
+
+        rows = self.index.ntotal
+        capacity = max(rows, 1024)
+        self._row_labels = np.full(capacity, -1, dtype=np.int64)
+        self._row_keys = np.full(capacity, None, dtype=object)
+        self._live = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        self._label_rows = {}
+        self._tombstones = 0
+        self._buffer_tombstones = 0
+
+        if row_labels is not None:
+            row_labels = np.asarray(row_labels, dtype=np.int64)
+            if len(row_labels) != rows:
+                raise ValueError(f"Expected {rows} row labels, got {len(row_labels)}")
+            self._row_labels[:rows] = row_labels
+            if row_keys is not None:
+                self._row_keys[:rows] = list(row_keys)
+            self._live[:] = np.packbits(np.arange(capacity) < rows, bitorder='little')
+            self._label_rows = {int(label): row for row, label in enumerate(row_labels)}
+
+    @property
+    def ntotal(self) -> int:
+        """Number of live vectors."""
+        return len(self._label_rows)
+
+    def __len__(self):
+        return self.ntotal
+
+    def __contains__(self, label):
+        return int(label) in self._label_rows
+
+    @property
+    def index_type(self) -> str:
+        return index_type_of(self.index)
+
+    @property
+    def _rows(self) -> int:
+        return self.index.ntotal + self._buffer.ntotal
+
+    def _reserve(self, rows: int):
+        capacity = len(self._row_labels)
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        row_labels = np.full(capacity, -1, dtype=np.int64)
+        row_labels[:len(self._row_labels)] = self._row_labels
+        row_keys = np.full(capacity, None, dtype=object)
+        row_keys[:len(self._row_keys)] = self._row_keys
+        live = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        live[:len(self._live)] = self._live
+        self._row_labels = row_labels
+        self._row_keys = row_keys
+        self._live = live
+
+    def _set_live(self, row: int, alive: bool):
+        mask = np.uint8(1 << (row & 7))
+        if alive:
+            self._live[row >> 3] |= mask
+        else:
+            self._live[row >> 3] &= ~mask
+
+    def _tombstone(self, label: int):
+        row = self._label_rows.pop(label)
+        self._row_labels[row] = -1
+        self._row_keys[row] = None
+        self._set_live(row, False)
+        self._tombstones += 1
+        if row >= self.index.ntotal:
+            self._buffer_tombstones += 1
+
+    def add(self, labels, vectors, keys=None):
+        """
+        Append vectors under the given labels, replacing any existing ones.
+
+        `keys` are optional objects (memory_ids) stored per row and returned
+        by search_keys() without any per-query lookup structure.
+        """
+        labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(labels), -1)
+        for label in labels:
+            if int(label) in self._label_rows:
+                self._tombstone(int(label))
+
+        start = self._rows
+        self._reserve(start + len(labels))
+        if self.auto_maintain and len(labels) >= self.min_merge_size:
+            # Bulk loads go straight to the main index
+            self._merge_buffer()
+            self.index.add(vectors)
+        else:
+            self._buffer.add(vectors)
+        for offset, label in enumerate(labels):
+            row = start + offset
+            self._row_labels[row] = label
+            self._row_keys[row] = keys[offset] if keys is not None else None
+            self._set_live(row, True)
+            self._label_rows[int(label)] = row
+
+        if self.auto_maintain:
+            if self._merge_due():
+                self._merge_buffer()
+            self._maybe_compact()
+
+    def replace(self, label: int, vector, key=None):
+        """Swap the vector stored under `label` for a new one."""
+        self.add([label], vector, keys=None if key is None else [key])
+
+    def remove(self, labels) -> int:
+        """Remove vectors by label. Returns how many were present."""
+        removed = 0
+        for label in labels:
+            if int(label) in self._label_rows:
+                self._tombstone(int(label))
+                removed += 1
+        if self.auto_maintain:
+            self._maybe_compact()
+        return removed
+
+    def _materialize(self):
+        if self.mapped:
+            # Mapped storage cannot be resized; a serialize round-trip gives an owned copy
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self.mapped = False
+
+    def _merge_buffer(self):
+        if self._buffer.ntotal == 0:
+            return
+        self._materialize()
+        self.index.add(self._buffer.reconstruct_n(0, self._buffer.ntotal))
+        self._buffer.reset()
+        self._buffer_tombstones = 0
+
+    def _merge_due(self) -> bool:
+        return self._buffer.ntotal >= max(self.min_merge_size, self.merge_ratio * self.index.ntotal)
+
+    def _compact_due(self) -> bool:
+        return bool(self._tombstones) and self._tombstones >= self.compact_ratio * self._rows
+
+    def _maybe_compact(self):
+        if self._compact_due():
+            self.compact()
+
+    @property
+    def compacted(self) -> bool:
+        """True when there is nothing buffered or tombstoned, so compact() is a no-op."""
+        return not self._buffer.ntotal and not self._tombstones
+
+    def needs_maintenance(self) -> bool:
+        """Whether the buffer is due for a merge or tombstones for compaction."""
+        return self._merge_due() or self._compact_due()
+
+    def maintain(self):
+        """Run whatever merge or compaction is due."""
+        if self._merge_due():
+            self._merge_buffer()
+        self._maybe_compact()
+
+    def copy(self) -> "IdMappedIndex":
+        """An independent in-memory copy; editing it leaves this index untouched."""
+        duplicate = IdMappedIndex.__new__(IdMappedIndex)
+        duplicate.__dict__.update(self.__dict__)
+        if self.mapped:
+            duplicate.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            duplicate.mapped = False
+        else:
+            duplicate.index = faiss.clone_index(self.index)
+        duplicate._buffer = faiss.clone_index(self._buffer)
+        duplicate._row_labels = self._row_labels.copy()
+        duplicate._row_keys = self._row_keys.copy()
+        duplicate._live = self._live.copy()
+        duplicate._label_rows = dict(self._label_rows)
+        return duplicate
+
+    def snapshot(self) -> "IdMappedIndex":
+        """
+        Like copy(), but sharing the main index instead of cloning it, so it
+        costs O(n) bookkeeping rather than O(n*d). The snapshot treats the
+        shared index as mapped and copies it before its first merge or
+        compaction. Only valid while this index never changes its main index
+        in place, i.e. with auto_maintain=False.
+        """
+        duplicate = IdMappedIndex.__new__(IdMappedIndex)
+        duplicate.__dict__.update(self.__dict__)
+        duplicate.mapped = True
+        duplicate._buffer = faiss.clone_index(self._buffer)
+        duplicate._row_labels = self._row_labels.copy()
+        duplicate._row_keys = self._row_keys.copy()
+        duplicate._live = self._live.copy()
+        duplicate._label_rows = dict(self._label_rows)
+        return duplicate
+
+    def compact(self):
+        """Merge buffered rows and physically drop tombstoned rows."""
+        self._merge_buffer()
+        if not self._tombstones:
+            return
+        self._materialize()
+        rows = self.index.ntotal
+        labels = self._row_labels[:rows]
+        if isinstance(self.index, faiss.IndexFlat):
+            dead = np.flatnonzero(labels < 0).astype(np.int64)
+            self.index.remove_ids(faiss.IDSelectorBatch(len(dead), faiss.swig_ptr(dead)))
+        else:
+            live_vectors = self.index.reconstruct_n(0, rows)[labels >= 0]
+            index = faiss.clone_index(self.index)
+            index.reset()
+            if isinstance(index, faiss.IndexIVF):
+                index.make_direct_map()
+            index.add(live_vectors)
+            self.index = index
+
+        live_labels = labels[labels >= 0]
+        live_keys = self._row_keys[:rows][labels >= 0]
+        self._row_labels[:] = -1
+        self._row_labels[:len(live_labels)] = live_labels
+        self._row_keys[:] = None
+        self._row_keys[:len(live_keys)] = live_keys
+        self._live[:] = np.packbits(np.arange(len(self._row_labels)) < len(live_labels), bitorder='little')
+        self._label_rows = {int(label): row for row, label in enumerate(live_labels)}
+        self._tombstones = 0
+
+    def _search_main(self, queries, k):
+        if self.index.ntotal == 0:
+            return (np.full((len(queries), k), np.inf, dtype=np.float32),
+                    np.full((len(queries), k), -1, dtype=np.int64))
+        if self._tombstones - self._buffer_tombstones:
+            selector = faiss.IDSelectorBitmap(self.index.ntotal, faiss.swig_ptr(self._live))
+            # Subclassed parameters replace the index's own nprobe/efSearch, so copy them over
+            if isinstance(self.index, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF()
+                params.nprobe = self.index.nprobe
+            elif isinstance(self.index, faiss.IndexHNSW):
+                params = faiss.SearchParametersHNSW()
+                params.efSearch = self.index.hnsw.efSearch
+            else:
+                params = faiss.SearchParameters()
+            params.sel = selector
+            return self.index.search(queries, k, params=params)
+        return self.index.search(queries, k)
+
+    def _search_buffer(self, queries, k):
+        # The buffer is small, so over-fetch past its tombstones instead of
+        # building a shifted selector for it
+        fetch = min(self._buffer.ntotal, k + self._buffer_tombstones)
+        distances, rows = self._buffer.search(queries, fetch)
+        rows = np.where(rows >= 0, rows + self.index.ntotal, -1)
+        dead = (rows < 0) | (self._row_labels[np.maximum(rows, 0)] < 0)
+        distances[dead] = np.inf
+        rows[dead] = -1
+        return distances, rows
+
+    def _search_rows(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.dimension)
+        distances, rows = self._search_main(queries, k)
+        if self._buffer.ntotal:
+            buffer_distances, buffer_rows = self._search_buffer(queries, k)
+            distances = np.hstack([distances, buffer_distances])
+            rows = np.hstack([rows, buffer_rows])
+            order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+            distances = np.take_along_axis(distances, order, axis=1)
+            rows = np.take_along_axis(rows, order, axis=1)
+        return distances, rows
+
+    def search(self, queries, k: int):
+        """
+        Search for the k nearest live vectors.
+
+        Returns (distances, labels) shaped like faiss.Index.search, with
+        label -1 where fewer than k results exist.
+        """
+        distances, rows = self._search_rows(queries, k)
+        labels = np.where(rows >= 0, self._row_labels[np.maximum(rows, 0)], -1)
+        return distances, labels
+
+    def search_keys(self, queries, k: int):
+        """
+        Like search(), but returns the row keys instead of labels.
+
+        Keys are gathered straight from the row table, so hydrating k results
+        costs O(k) with no allocation that grows with the index. Missing
+        results come back as None.
+        """
+        distances, rows = self._search_rows(queries, k)
+        keys = self._row_keys[np.maximum(rows, 0)]
+        keys[rows < 0] = None
+        return distances, keys
+
+    def row_labels(self) -> np.ndarray:
+        """Labels of the index rows in order, after compaction."""
+        self.compact()
+        return self._row_labels[:self.index.ntotal].copy()
+
+    def row_keys(self) -> np.ndarray:
+        """Keys of the index rows in order, after compaction."""
+        self.compact()
+        return self._row_keys[:self.index.ntotal].copy()
+
+    def vectors(self) -> np.ndarray:
+        """All vectors in row order, after compaction."""
+        self.compact()
+        if self.index.ntotal == 0:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def reconstruct(self, label: int) -> np.ndarray:
+        row = self._label_rows[int(label)]
+        if row >= self.index.ntotal:
+            return self._buffer.reconstruct(row - self.index.ntotal)
+        return self.index.reconstruct(row)
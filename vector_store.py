@@ -0,0 +1,110 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+
+
+def content_hash(text: str) -> bytes:
+    """sha256 digest of a memory's content, stored per vector row."""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def _save_array(path: str, array: np.ndarray):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class VectorStore:
+    """
+    Versioned on-disk layout of the FAISS index and the metadata of its rows.
+
+    <directory>/v<N>/memory_index.faiss   the index, memory-mapped on load
+    <directory>/v<N>/memory_ids.npy       memory_id of each row
+    <directory>/v<N>/content_sha256.npy   (n, 32) uint8 digest of the content each row was embedded from
+
+    Every save writes a complete new version directory and leaves the
+    current one alone; the checkpoint manifest names the version to load,
+    so renaming the manifest into place is the single commit point and a
+    failed save never pairs row ids with another version's index. Arrays
+    are opened with np.load(mmap_mode='r'), so loading costs O(1) and
+    pages are only read when touched. Memory content is not stored here;
+    memories.json stays the single copy of it.
+
+    Before versioning, the .npy files sat directly in <directory> and the
+    index at Database.vector_index_file; version 0 reads that layout.
+    """
+
+    INDEX_FILE = "memory_index.faiss"
+
+    def __init__(self, directory: str = "./vector_store"):
+        """
+        Args:
+            directory: Directory holding the version directories.
+        """
+        self.directory = directory
+
+    def _path(self, version: int, name: str) -> str:
+        if not version:
+            return os.path.join(self.directory, name)
+        return os.path.join(self.directory, f"v{version}", name)
+
+    def index_path(self, version: int) -> str:
+        return self._path(version, self.INDEX_FILE)
+
+    def exists(self, version: int = 0) -> bool:
+        names = ("memory_ids.npy", "content_sha256.npy") + ((self.INDEX_FILE,) if version else ())
+        return all(os.path.exists(self._path(version, name)) for name in names)
+
+    def save(self, version: int, memory_ids, content_hashes, index):
+        """Write the index and its row columns as a new version directory."""
+        import faiss
+        directory = os.path.dirname(self.index_path(version))
+        # Left over from a save that failed before its manifest was written
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        memory_ids = np.asarray(list(memory_ids), dtype=str)
+        hashes = np.frombuffer(b"".join(content_hashes), dtype=np.uint8).reshape(-1, 32)
+        _save_array(self._path(version, "memory_ids.npy"), memory_ids)
+        _save_array(self._path(version, "content_sha256.npy"), hashes)
+        index_file = self.index_path(version)
+        faiss.write_index(index, index_file)
+        with open(index_file, 'rb') as f:
+            os.fsync(f.fileno())
+
+    def load(self, version: int = 0):
+        """
+        Return (memory_ids, content_hashes) of a version, each memory-mapped read-only.
+        """
+        memory_ids = np.load(self._path(version, "memory_ids.npy"), mmap_mode='r')
+        hashes = np.load(self._path(version, "content_sha256.npy"), mmap_mode='r')
+        return memory_ids, hashes
+
+    def prune(self, keep: int):
+        """Delete every version but `keep`, and the unversioned layout, once `keep` is committed."""
+        if not keep or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name[:1] == "v" and name[1:].isdigit() and int(name[1:]) != keep:
+                shutil.rmtree(path, ignore_errors=True)
+            elif name in ("vectors.npy", "memory_ids.npy", "content_sha256.npy"):
+                os.remove(path)
+
+
+def read_index_mmap(path: str):
+    """
+    Read a FAISS index with its storage memory-mapped when this FAISS build
+    supports it. Returns (index, mapped); a mapped index must not be written to.
+    """
+    import faiss
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if flag is not None:
+        try:
+            return faiss.read_index(path, flag), True
+        except RuntimeError:
+            pass
+    return faiss.read_index(path), False